@@ -0,0 +1,52 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    predictions: {
+        // Adds the predicted squares at or above the selected confidence to
+        // the map sent by the server, as get_fire_map draws them.
+        filterCells: function(data, conf) {
+            if (!data) {
+                return window.dash_clientside.no_update;
+            }
+            const cells = data.cells;
+            const lat = [];
+            const lon = [];
+            const hovertemplate = [];
+            const customdata = [];
+            for (let i = 0; i < cells.pred_bin.length; i++) {
+                if (cells.pred_bin[i] < conf) {
+                    continue;
+                }
+                const hover = '(%{lat}°, %{lon}°)' +
+                    '<br>Confidence: ' + (cells.pred[i] * 100).toFixed(2) + '%' +
+                    '<br>Actual: ' + (cells.target[i] === 1 ? 'Fire' : 'No Fire') +
+                    '<br>Click to view SHAP force plot<extra>Fire Prediction</extra>';
+                for (let j = 0; j < data.lat_offsets.length; j++) {
+                    lat.push(cells.lat[i] + data.lat_offsets[j]);
+                    lon.push(cells.lon[i] + data.lon_offsets[j]);
+                    hovertemplate.push(hover);
+                    customdata.push(cells.key[i]);
+                }
+                lat.push(null);
+                lon.push(null);
+                hovertemplate.push(null);
+                customdata.push(null);
+            }
+
+            const trace = {
+                type: 'scattermapbox',
+                mode: 'lines',
+                fill: 'toself',
+                fillcolor: 'rgba(0,0,0,0)',
+                lat: lat,
+                lon: lon,
+                marker: {color: 'blue'},
+                hovertemplate: hovertemplate,
+                customdata: customdata,
+                name: 'Fire Prediction (Based on confidence threshold)',
+            };
+            return {
+                data: [trace].concat(data.figure.data),
+                layout: data.figure.layout,
+            };
+        },
+    },
+});
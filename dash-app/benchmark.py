@@ -0,0 +1,317 @@
+"""Offline latency benchmark of the Dash callbacks on synthetic data.
+
+Generate a dataset with the schemas of the app's data files at a multiple
+of their size, then drive the callbacks through the Flask test client:
+
+    python3 benchmark.py generate --scale 10 --out /tmp/bench-10x
+    python3 benchmark.py run --data /tmp/bench-10x
+
+`run` builds the snapshot of the dataset if needed, imports main.py with
+APP_DATA_DIR pointing at it and reports latency percentiles, throughput,
+response sizes and peak RSS for each request mix.
+"""
+import argparse
+import json
+import os
+import resource
+import time
+
+import numpy as np
+import pandas as pd
+
+from datasets import (
+    DATA_FILE, E, FIRE_IDS_FILE, N, S, SNAPSHOT_DIR, W, get_sources,
+    read_csv_datasets, save_snapshot, snapshot_is_current, square_side_degrees,
+)
+from detection_grid import grid_refs
+from shap_store import SHAP_ENTRY_DTYPE, SHAP_INDEX_DTYPE
+
+curdir = os.path.dirname(os.path.abspath(__file__))
+
+# Size of the 1x dataset
+FIRES = 2000
+FIRST_DATE = '2014-01-01'
+LAST_DATE = '2022-01-31'
+FIRST_PREDICTION_DATE = '2021-01-01'
+COUNTIES = [
+    'Butte', 'Colusa', 'Del Norte', 'El Dorado', 'Glenn', 'Humboldt', 'Lake',
+    'Lassen', 'Mendocino', 'Modoc', 'Napa', 'Nevada', 'Placer', 'Plumas',
+    'Shasta', 'Sierra', 'Siskiyou', 'Sonoma', 'Tehama', 'Trinity', 'Yuba',
+]
+
+
+def generate(out, scale=1, shap_days=60, shap_features=30, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(out, exist_ok=True)
+    dates = pd.date_range(FIRST_DATE, LAST_DATE)
+    first_prediction = dates.get_loc(pd.Timestamp(FIRST_PREDICTION_DATE))
+
+    # Fires burn for a few days around a centre and spread as they go
+    n_fires = int(FIRES * scale)
+    starts = rng.integers(0, len(dates), n_fires)
+    durations = np.minimum(rng.geometric(0.2, n_fires), 60)
+    centers_lat = rng.uniform(37.4, 42.4, n_fires)
+    centers_lon = rng.uniform(-124.3, -118.9, n_fires)
+    fire_days = np.repeat(np.arange(n_fires), durations)
+    day_offsets = np.arange(len(fire_days)) - np.repeat(np.cumsum(durations) - durations, durations)
+    days = starts[fire_days] + day_offsets
+    keep = days < len(dates)
+    fire_days, day_offsets, days = fire_days[keep], day_offsets[keep], days[keep]
+
+    counts = rng.poisson(25, len(fire_days)) + 1
+    rows = np.repeat(np.arange(len(fire_days)), counts)
+    spread = 0.01 + 0.01 * day_offsets[rows]
+    hist = pd.DataFrame({
+        'latitude': np.round(centers_lat[fire_days[rows]] + rng.normal(0, spread), 5),
+        'longitude': np.round(centers_lon[fire_days[rows]] + rng.normal(0, spread), 5),
+        'date': dates[days[rows]].strftime('%Y-%m-%d'),
+        'type': 'Historic',
+        'Target': np.nan,
+        'Pred': np.nan,
+    })
+
+    # One fire-ID row per fire and day, numbered in order of first day
+    fire_ids = np.argsort(np.argsort(starts, kind='mergesort')) + 1
+    bounds = hist.groupby(rows).agg(
+        lat_min=('latitude', 'min'), lat_max=('latitude', 'max'),
+        long_min=('longitude', 'min'), long_max=('longitude', 'max'),
+    )
+    df_fids = pd.DataFrame({
+        'wildfire_id': fire_ids[fire_days],
+        'date': dates[days].strftime('%Y-%m-%d'),
+    }).join(bounds.reset_index(drop=True))
+    df_fids['county'] = [
+        str([str(county) for county in rng.choice(COUNTIES, k, replace=False)])
+        for k in rng.integers(0, 4, len(df_fids))
+    ]
+    df_fids.to_csv(os.path.join(out, FIRE_IDS_FILE))
+
+    # Predictions for the grid cells around the detections of each day
+    # from FIRST_PREDICTION_DATE on.
+    lat_refs = grid_refs(S, N, square_side_degrees)
+    lon_refs = grid_refs(W, E, square_side_degrees)
+    n_lat, n_lon = len(lat_refs) - 60, len(lon_refs) - 60
+    recent = (days >= first_prediction)[rows]
+    lat_cells = np.floor((hist['latitude'].to_numpy()[recent] - S) / square_side_degrees).astype(np.int64) + 30
+    lon_cells = np.floor((hist['longitude'].to_numpy()[recent] - W) / square_side_degrees).astype(np.int64) + 30
+    pred_days = days[rows][recent]
+    offsets = np.array([-1, 0, 1])
+    lat_cells, lon_cells = np.broadcast_arrays(
+        lat_cells[:, None, None] + offsets[:, None], lon_cells[:, None, None] + offsets[None, :]
+    )
+    lat_cells, lon_cells = lat_cells.ravel(), lon_cells.ravel()
+    pred_days = np.repeat(pred_days, 9)
+    inside = (lat_cells >= 30) & (lat_cells < 30 + n_lat) & (lon_cells >= 30) & (lon_cells < 30 + n_lon)
+    cells = np.unique(np.stack([pred_days, lat_cells, lon_cells])[:, inside], axis=1)
+    pred_values = rng.beta(0.6, 2.5, cells.shape[1])
+    pred = pd.DataFrame({
+        'latitude': lat_refs[cells[1]],
+        'longitude': lon_refs[cells[2]],
+        'date': dates[cells[0]].strftime('%Y-%m-%d'),
+        'type': 'Prediction',
+        'Target': (rng.random(cells.shape[1]) < pred_values).astype(float),
+        'Pred': pred_values,
+    })
+    pd.concat([hist, pred], ignore_index=True).to_csv(os.path.join(out, DATA_FILE))
+
+    # SHAP values of the predictions of the last `shap_days` days
+    with open(os.path.join(curdir, 'modeling-2_featureNames.txt')) as f:
+        feature_names = f.read().splitlines()
+    shap_rows = np.flatnonzero(cells[0] >= len(dates) - shap_days)
+    key_days = dates[cells[0][shap_rows]].to_numpy().astype('datetime64[D]').astype(np.int64)
+    lat_codes = np.rint(np.round(pred['latitude'].to_numpy()[shap_rows], 3) * 1000).astype(np.int64) + 2**19
+    lon_codes = np.rint(np.round(pred['longitude'].to_numpy()[shap_rows], 3) * 1000).astype(np.int64) + 2**19
+    index = np.zeros(len(shap_rows), dtype=SHAP_INDEX_DTYPE)
+    index['key'] = (key_days << 40) | (lat_codes << 20) | lon_codes
+    index['start'] = np.arange(len(shap_rows)) * shap_features
+    index['stop'] = index['start'] + shap_features
+    index['base_value'] = 0.1
+    index.sort(order='key')
+    entries = np.zeros(len(shap_rows) * shap_features, dtype=SHAP_ENTRY_DTYPE)
+    entries['feature'] = np.sort(
+        rng.random((len(shap_rows), len(feature_names))).argsort(axis=1)[:, :shap_features], axis=1
+    ).ravel()
+    entries['effect'] = rng.normal(0, 0.02, len(entries))
+    entries['value'] = np.round(rng.normal(50, 20, len(entries)), 2)
+    store = os.path.join(out, 'shap_store')
+    os.makedirs(store, exist_ok=True)
+    entries.tofile(os.path.join(store, 'entries.bin'))
+    np.save(os.path.join(store, 'index.npy'), index)
+    with open(os.path.join(store, 'feature_names.json'), 'w') as f:
+        json.dump(feature_names, f)
+
+    print('{} detections, {} predictions, {} fire-days, {} SHAP keys written to {}'.format(
+        len(hist), len(pred), len(df_fids), len(shap_rows), out
+    ))
+
+
+class DashClient:
+    """Posts callback requests the way the Dash renderer does."""
+
+    def __init__(self, main):
+        self.client = main.app.test_client()
+        self.callbacks = main.dash_app.callback_map
+
+    def call(self, output, values, changed):
+        # `output` is one output ('id.property') of the callback to run,
+        # `values` the inputs and state by 'id.property'.
+        key = next(key for key in self.callbacks if output in key.strip('.').split('...'))
+        spec = self.callbacks[key]
+        outputs = [item.rsplit('.', 1) for item in key.strip('.').split('...')]
+
+        def props(items):
+            return [
+                {
+                    'id': item['id'], 'property': item['property'],
+                    'value': values.get('{}.{}'.format(item['id'], item['property'])),
+                }
+                for item in items
+            ]
+
+        payload = {
+            'output': key,
+            'outputs': [{'id': id, 'property': prop} for id, prop in outputs],
+            'inputs': props(spec['inputs']),
+            'state': props(spec['state']),
+            'changedPropIds': changed,
+        }
+        if len(outputs) == 1:
+            payload['outputs'] = payload['outputs'][0]
+        response = self.client.post('/_dash-update-component', json=payload)
+        if response.status_code not in (200, 204):
+            raise RuntimeError('{} returned {}'.format(output, response.status_code))
+        return response
+
+
+def get_scenarios(main, requests, rng):
+    # Request mixes as (name, output, values, changed) lists
+    pred_dates = pd.date_range(FIRST_PREDICTION_DATE, LAST_DATE)
+    all_dates = pd.date_range(FIRST_DATE, LAST_DATE)
+    prediction_output = 'fire-dropdown.options'
+    scenarios = {}
+
+    scenarios['pages'] = [
+        ('page-content.children', {'url.pathname': path}, ['url.pathname'])
+        for path in ['/predictions', '/history', '/evaluation'] * (requests // 3 + 1)
+    ][:requests]
+
+    start = rng.integers(0, len(pred_dates) - requests)
+    scenarios['date scrubbing'] = [
+        (prediction_output, {
+            'date-picker.date': str(date.date()),
+            'conf-slider.value': main.DEFAULT_CONFIDENCE,
+        }, ['date-picker.date'])
+        for date in pred_dates[start:start + requests]
+    ]
+
+    slider = []
+    for conf in rng.integers(1, 100, requests):
+        slider.append(('confusion-matrix.figure', {
+            'eval-date-picker-range.start_date': FIRST_PREDICTION_DATE,
+            'eval-date-picker-range.end_date': LAST_DATE,
+            'eval-conf-slider.value': int(conf),
+        }, ['eval-conf-slider.value']))
+        if not main.CLIENTSIDE_FILTERING:
+            slider.append((prediction_output, {
+                'date-picker.date': '2021-07-01', 'conf-slider.value': int(conf),
+            }, ['conf-slider.value']))
+    scenarios['slider drags'] = slider[:requests]
+
+    history = []
+    for _ in range(requests // 2):
+        years = rng.integers(1, 9)
+        first = rng.integers(0, max(1, len(all_dates) - 365 * years))
+        start_date = str(all_dates[first].date())
+        end_date = str(all_dates[min(len(all_dates) - 1, first + 365 * years)].date())
+        values = {'hist-date-picker.start_date': start_date, 'hist-date-picker.end_date': end_date}
+        history.append(('hist-firemap.figure', values, ['hist-date-picker.end_date']))
+        zoom = float(rng.uniform(7, 11))
+        lat, lon = rng.uniform(38, 41.5), rng.uniform(-123.5, -120)
+        history.append(('hist-firemap.figure', dict(values, **{
+            'hist-firemap.relayoutData': {
+                'mapbox.center': {'lat': lat, 'lon': lon}, 'mapbox.zoom': zoom,
+            },
+        }), ['hist-firemap.relayoutData']))
+    scenarios['history ranges'] = history
+
+    clicks = []
+    if main.shap_store is not None and len(main.shap_store.index):
+        keys = main.shap_store.index['key'][rng.integers(0, len(main.shap_store.index), requests)]
+        for code in keys.tolist():
+            day = np.datetime64(code >> 40, 'D')
+            lat = ((code >> 20) & (2**20 - 1)) - 2**19
+            lon = (code & (2**20 - 1)) - 2**19
+            key = '{}_{}_{}'.format(day, lat / 1000, lon / 1000)
+            clicks.append(('clicks.data', {
+                'firemap.clickData': {'points': [{'customdata': key}]},
+                'clicks.data': len(clicks),
+            }, ['firemap.clickData']))
+    scenarios['map clicks'] = clicks
+
+    return scenarios
+
+
+def run(data_dir, requests=100, seed=0, output=None):
+    if not snapshot_is_current(os.path.join(data_dir, SNAPSHOT_DIR), data_dir):
+        save_snapshot(read_csv_datasets(data_dir), os.path.join(data_dir, SNAPSHOT_DIR), get_sources(data_dir))
+
+    os.environ['APP_DATA_DIR'] = data_dir
+    os.chdir(curdir)
+    start = time.perf_counter()
+    import main
+    startup = time.perf_counter() - start
+
+    client = DashClient(main)
+    results = {'startup seconds': startup}
+    print('{:<16} {:>8} {:>9} {:>9} {:>9} {:>10} {:>12}'.format(
+        'mix', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'mean bytes'
+    ))
+    for name, calls in get_scenarios(main, requests, np.random.default_rng(seed)).items():
+        if not calls:
+            continue
+        latencies = []
+        sizes = []
+        total = time.perf_counter()
+        for target, values, changed in calls:
+            start = time.perf_counter()
+            response = client.call(target, values, changed)
+            latencies.append(time.perf_counter() - start)
+            sizes.append(len(response.data))
+        total = time.perf_counter() - total
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        results[name] = {
+            'requests': len(calls), 'p50 ms': p50, 'p95 ms': p95, 'p99 ms': p99,
+            'requests per second': len(calls) / total, 'mean bytes': float(np.mean(sizes)),
+        }
+        print('{:<16} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>10.1f} {:>12.0f}'.format(
+            name, len(calls), p50, p95, p99, len(calls) / total, np.mean(sizes)
+        ))
+
+    # ru_maxrss is in kilobytes on Linux
+    results['peak rss mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print('startup {:.2f} s, peak RSS {:.0f} MB'.format(startup, results['peak rss mb']))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    parser_generate = commands.add_parser('generate', help='write a synthetic dataset')
+    parser_generate.add_argument('--out', required=True)
+    parser_generate.add_argument('--scale', type=float, default=1)
+    parser_generate.add_argument('--shap-days', type=int, default=60)
+    parser_generate.add_argument('--shap-features', type=int, default=30)
+    parser_generate.add_argument('--seed', type=int, default=0)
+    parser_run = commands.add_parser('run', help='benchmark the callbacks on a dataset')
+    parser_run.add_argument('--data', required=True)
+    parser_run.add_argument('--requests', type=int, default=100)
+    parser_run.add_argument('--seed', type=int, default=0)
+    parser_run.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        generate(args.out, args.scale, args.shap_days, args.shap_features, args.seed)
+    else:
+        run(os.path.abspath(args.data), args.requests, args.seed, args.json and os.path.abspath(args.json))
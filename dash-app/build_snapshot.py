@@ -0,0 +1,18 @@
+"""Builds the binary snapshot that main.py loads instead of the CSV files.
+
+Run after replacing modeling-2_historic_and_predictions.csv.gz or
+modeling-2_fire_ids.csv.gz:
+
+    python3 build_snapshot.py [data directory]
+"""
+import os
+import sys
+
+from datasets import SNAPSHOT_DIR, get_sources, read_csv_datasets, save_snapshot
+
+
+if __name__ == '__main__':
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(data_dir, SNAPSHOT_DIR)
+    save_snapshot(read_csv_datasets(data_dir), path, get_sources(data_dir))
+    print('Snapshot written to {}'.format(path))
@@ -0,0 +1,74 @@
+import numpy as np
+
+
+def confidence_bins(preds, steps=100):
+    # Pred >= k / steps exactly when k <= bin, for a confidence slider in
+    # whole percent.  Missing predictions fall in bin 0.
+    thresholds = np.arange(steps + 1) / steps
+    bins = np.searchsorted(thresholds, np.nan_to_num(preds), side='right') - 1
+    return bins.astype(np.uint8)
+
+
+class ConfusionCube:
+    """Cumulative confusion-matrix counts by date and confidence threshold.
+
+    `tp[d, k]` holds the true positives of all dates before `days[d]` when
+    predicting fire for bin >= k (see `confidence_bins`) (likewise `fp`, and `pos`/`neg`
+    for the number of actual fires/non-fires), so the counts of any date
+    range are a difference of two rows.
+    """
+
+    def __init__(self, dates, bins, targets, steps=100):
+        self.thresholds = np.arange(steps + 1) / steps
+        self.days = np.unique(dates)
+
+        cells = np.searchsorted(self.days, dates).astype(np.int64) * (steps + 1) + bins
+        shape = (len(self.days), steps + 1)
+        fire = targets == 1
+        pos = np.bincount(cells[fire], minlength=shape[0] * shape[1]).reshape(shape)
+        neg = np.bincount(cells[~fire], minlength=shape[0] * shape[1]).reshape(shape)
+
+        def prefix(counts):
+            return np.concatenate([np.zeros_like(counts[:1]), counts.cumsum(axis=0)])
+
+        self.tp = prefix(pos[:, ::-1].cumsum(axis=1)[:, ::-1])
+        self.fp = prefix(neg[:, ::-1].cumsum(axis=1)[:, ::-1])
+        self.pos = prefix(pos.sum(axis=1))
+        self.neg = prefix(neg.sum(axis=1))
+
+    def to_arrays(self):
+        arrays = {
+            'thresholds': self.thresholds, 'days': self.days,
+            'tp': self.tp, 'fp': self.fp, 'pos': self.pos, 'neg': self.neg,
+        }
+        return arrays, {}
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        cube = cls.__new__(cls)
+        for name, values in arrays.items():
+            setattr(cube, name, values)
+        return cube
+
+    @property
+    def nbytes(self):
+        return self.days.nbytes + self.tp.nbytes + self.fp.nbytes + self.pos.nbytes + self.neg.nbytes
+
+    def counts(self, start_date, end_date):
+        # (tp, fp, fn, tn), each an array over the threshold grid
+        i = np.searchsorted(self.days, start_date, side='left')
+        j = max(i, np.searchsorted(self.days, end_date, side='right'))
+        tp = self.tp[j] - self.tp[i]
+        fp = self.fp[j] - self.fp[i]
+        fn = (self.pos[j] - self.pos[i]) - tp
+        tn = (self.neg[j] - self.neg[i]) - fp
+        return tp, fp, fn, tn
+
+    def scores(self, start_date, end_date):
+        # recall, precision and F1 over the threshold grid; 0 where undefined
+        tp, fp, fn, tn = self.counts(start_date, end_date)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            recall = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+            precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+            f1 = np.where(2 * tp + fp + fn > 0, 2 * tp / (2 * tp + fp + fn), 0.0)
+        return recall, precision, f1
@@ -0,0 +1,154 @@
+import ast
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from confusion import ConfusionCube, confidence_bins
+from date_index import DateIndex
+from detection_grid import DetectionGrid
+from fire_index import FireIndex
+from tile_index import TileIndex
+
+DATA_FILE = 'modeling-2_historic_and_predictions.csv.gz'
+FIRE_IDS_FILE = 'modeling-2_fire_ids.csv.gz'
+SNAPSHOT_DIR = 'snapshot'
+SNAPSHOT_VERSION = 2
+
+# Resident dtypes of the display data (dates are kept as int16 day numbers).
+DISPLAY_SCHEMA = {
+    'latitude': np.float32,
+    'longitude': np.float32,
+    'Target': np.uint8,
+    'Pred': np.float32,
+    'pred_bin': np.uint8,
+}
+
+square_side_miles = 1
+miles_per_degree = 24901.461 / 360 # circumference of earth at equator divided by 360
+square_side_degrees = square_side_miles / miles_per_degree
+
+# Modeling grid extent, as in modeling/common.py
+S = 37.25411
+N = 42.59896
+E = -118.73987
+W = -124.51868
+
+DATASETS = {
+    'data': DateIndex,
+    'confusion': ConfusionCube,
+    'detections': DetectionGrid,
+    'fires': FireIndex,
+    'tiles': TileIndex,
+}
+
+
+def read_csv_datasets(curdir):
+    df = pd.read_csv(
+        os.path.join(curdir, DATA_FILE),
+        usecols=['latitude', 'longitude', 'date', 'type', 'Target', 'Pred'],
+        parse_dates=['date'],
+        dtype={'type': 'category', 'latitude': np.float32, 'longitude': np.float32},
+    )
+    df['Target'] = df['Target'].fillna(0)
+    df['pred_bin'] = confidence_bins(df['Pred'].to_numpy())
+    data = DateIndex(df, order_col='pred_bin', schema=DISPLAY_SCHEMA)
+    del df
+    predictions = data.rows('Prediction')
+    confusion = ConfusionCube(
+        data['date'][predictions], data['pred_bin'][predictions], data['Target'][predictions]
+    )
+    historic = data.rows('Historic')
+    detections = DetectionGrid(
+        data['date'][historic], data['latitude'][historic], data['longitude'][historic],
+        S, W, square_side_degrees,
+    )
+    tiles = TileIndex(data, S, W, square_side_degrees)
+
+    df_fids = pd.read_csv(
+        os.path.join(curdir, FIRE_IDS_FILE),
+        usecols=[
+            'wildfire_id', 'date', 'lat_min', 'lat_max', 'long_min', 'long_max',
+            'county'
+        ],
+        parse_dates=['date'],
+    )
+    df_fids['county'] = df_fids['county'].apply(ast.literal_eval)
+    fires = FireIndex(df_fids)
+
+    return {
+        'data': data, 'confusion': confusion, 'detections': detections,
+        'fires': fires, 'tiles': tiles,
+    }
+
+
+def get_sources(curdir):
+    # Size and modification time of the CSV artifacts a snapshot was built from
+    sources = {}
+    for name in [DATA_FILE, FIRE_IDS_FILE]:
+        stat = os.stat(os.path.join(curdir, name))
+        sources[name] = [stat.st_size, stat.st_mtime]
+    return sources
+
+
+# A snapshot is a directory per dataset holding one .npy file per array and
+# a meta.json with everything else, plus a manifest recording the sources.
+def save_snapshot(datasets, path, sources):
+    # The manifest is written last, so an interrupted build is never loaded
+    manifest = os.path.join(path, 'manifest.json')
+    if os.path.exists(manifest):
+        os.remove(manifest)
+    for name, dataset in datasets.items():
+        folder = os.path.join(path, name)
+        os.makedirs(folder, exist_ok=True)
+        arrays, meta = dataset.to_arrays()
+        for key, values in arrays.items():
+            np.save(os.path.join(folder, key + '.npy'), values, allow_pickle=False)
+        meta['arrays'] = list(arrays)
+        with open(os.path.join(folder, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    with open(manifest, 'w') as f:
+        json.dump({'version': SNAPSHOT_VERSION, 'sources': sources}, f)
+
+
+# Arrays are memory-mapped read-only by default, so every gunicorn worker
+# maps the same files and they share one copy through the page cache.
+def load_snapshot(path, mmap_mode='r'):
+    datasets = {}
+    for name, cls in DATASETS.items():
+        folder = os.path.join(path, name)
+        with open(os.path.join(folder, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {
+            key: np.load(os.path.join(folder, key + '.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+            for key in meta.pop('arrays')
+        }
+        datasets[name] = cls.from_arrays(arrays, meta)
+    return datasets
+
+
+def snapshot_is_current(path, curdir):
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return False
+    if manifest['version'] != SNAPSHOT_VERSION:
+        return False
+    # The CSVs are optional once a snapshot has been built from them
+    try:
+        return manifest['sources'] == get_sources(curdir)
+    except FileNotFoundError:
+        return True
+
+
+def load_datasets(curdir):
+    path = os.path.join(curdir, SNAPSHOT_DIR)
+    if snapshot_is_current(path, curdir):
+        print('Mapping snapshot from {}'.format(path))
+        return load_snapshot(path)
+    if os.path.exists(path):
+        print('Snapshot in {} is out of date, reading the CSV files'.format(path))
+    return read_csv_datasets(curdir)
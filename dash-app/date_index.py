@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+
+# Dates are held as int16 day numbers counted so that day 1 is 2014-01-01,
+# the same numbering as date_id in the modeling data.
+DAY_ZERO = np.datetime64('2013-12-31', 'D')
+
+
+def to_day(date):
+    return int((pd.Timestamp(date).to_datetime64().astype('datetime64[D]') - DAY_ZERO).astype(np.int64))
+
+
+def to_days(dates):
+    return (np.asarray(dates).astype('datetime64[D]') - DAY_ZERO).astype(np.int16)
+
+
+def to_dates(days):
+    return DAY_ZERO + days.astype(np.int64)
+
+
+class DateIndex:
+    """Display rows sorted by (type, date) with a per-date offset table.
+
+    Each type ('Historic', 'Prediction') occupies one contiguous block of
+    rows.  Within a block, `days` holds the distinct dates and `offsets`
+    the row where each of them starts, so a single day or a date range
+    maps to one slice of the column arrays via binary search.  Rows of a
+    day are further sorted by `order_col`, so a threshold on that column
+    is a binary-search cut of the day's slice.  Columns are stored with the
+    dtypes given in `schema` and dates as day numbers (see `to_days`).
+    """
+
+    def __init__(self, df, kind_col='type', date_col='date', order_col=None, schema=None):
+        df = df.assign(**{kind_col: df[kind_col].astype(str)})
+        sort_cols = [kind_col, date_col] + ([order_col] if order_col else [])
+        df = df.sort_values(sort_cols, kind='mergesort')
+
+        kinds = df[kind_col].to_numpy()
+        schema = schema or {}
+        self.columns = {
+            col: df[col].to_numpy(dtype=schema.get(col))
+            for col in df.columns if col not in (kind_col, date_col)
+        }
+        self.columns[date_col] = to_days(df[date_col].to_numpy())
+        self.date_col = date_col
+        self.order_col = order_col
+
+        self.partitions = {}
+        for kind in np.unique(kinds):
+            lo = np.searchsorted(kinds, kind, side='left')
+            hi = np.searchsorted(kinds, kind, side='right')
+            dates = self.columns[date_col][lo:hi]
+            starts = np.flatnonzero(np.r_[True, dates[1:] != dates[:-1]])
+            self.partitions[kind] = (dates[starts], np.r_[starts, hi - lo] + lo)
+
+    def to_arrays(self):
+        arrays = {'col.' + col: values for col, values in self.columns.items()}
+        for kind, (days, offsets) in self.partitions.items():
+            arrays['days.' + kind] = days
+            arrays['offsets.' + kind] = offsets
+        meta = {
+            'date_col': self.date_col,
+            'order_col': self.order_col,
+            'kinds': list(self.partitions),
+        }
+        return arrays, meta
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        index = cls.__new__(cls)
+        index.columns = {
+            name[len('col.'):]: values for name, values in arrays.items()
+            if name.startswith('col.')
+        }
+        index.date_col = meta['date_col']
+        index.order_col = meta['order_col']
+        index.partitions = {
+            kind: (arrays['days.' + kind], arrays['offsets.' + kind])
+            for kind in meta['kinds']
+        }
+        return index
+
+    def __getitem__(self, col):
+        return self.columns[col]
+
+    def __len__(self):
+        return len(self.columns[self.date_col])
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.columns.values())
+
+    def rows(self, kind):
+        if kind not in self.partitions:
+            return slice(0, 0)
+        days, offsets = self.partitions[kind]
+        return slice(offsets[0], offsets[-1])
+
+    def day(self, kind, date):
+        if kind not in self.partitions:
+            return slice(0, 0)
+        days, offsets = self.partitions[kind]
+        date = to_day(date)
+        i = np.searchsorted(days, date)
+        if i == len(days) or days[i] != date:
+            return slice(0, 0)
+        return slice(offsets[i], offsets[i + 1])
+
+    def span(self, kind, start_date, end_date):
+        if kind not in self.partitions:
+            return slice(0, 0)
+        days, offsets = self.partitions[kind]
+        i = np.searchsorted(days, to_day(start_date), side='left')
+        j = np.searchsorted(days, to_day(end_date), side='right')
+        if j <= i:
+            return slice(0, 0)
+        return slice(offsets[i], offsets[j])
+
+    def above(self, kind, date, threshold):
+        rows = self.day(kind, date)
+        values = self.columns[self.order_col][rows]
+        return slice(rows.start + np.searchsorted(values, threshold), rows.stop)
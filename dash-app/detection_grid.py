@@ -0,0 +1,92 @@
+import numpy as np
+
+CELL_BITS = 20
+CELL_OFFSET = 2**19
+CELL_MASK = 2**CELL_BITS - 1
+
+
+def pack_cells(lat_cells, lon_cells):
+    return ((lat_cells + CELL_OFFSET) << CELL_BITS) | (lon_cells + CELL_OFFSET)
+
+
+def unpack_cells(keys):
+    return (keys >> CELL_BITS & CELL_MASK) - CELL_OFFSET, (keys & CELL_MASK) - CELL_OFFSET
+
+
+def grid_refs(start, stop, step, extra=30):
+    # Cell centres by position, as get_ref_dictionaries in modeling/common.py
+    # builds them, including the `extra` ids past each edge of the extent.
+    refs = np.arange(start, stop, step)[:-1] + step / 2
+    below = [refs[0] - (i + 1) * step for i in range(extra)][::-1]
+    above = [refs[-1] + (i + 1) * step for i in range(extra)]
+    return np.r_[below, refs, above]
+
+
+def snap(values, refs):
+    # Nearest cell centre of each (e.g. float32 rounded) coordinate.
+    step = refs[1] - refs[0]
+    i = np.rint((values.astype(np.float64) - refs[0]) / step).astype(np.int64)
+    return refs[np.clip(i, 0, len(refs) - 1)]
+
+
+class DetectionGrid:
+    """Historic detections counted per day on the modeling grid.
+
+    Cells are numbered from the (south, west) corner of the grid in steps
+    of `step` degrees; the rows are sorted by day so a date range is one
+    slice, which can then be merged into cells `factor` times coarser.
+    """
+
+    def __init__(self, dates, lats, lons, south, west, step):
+        self.south, self.west, self.step = south, west, step
+        lat_cells = np.floor((lats.astype(np.float64) - south) / step).astype(np.int64)
+        lon_cells = np.floor((lons.astype(np.float64) - west) / step).astype(np.int64)
+        keys = dates.astype(np.int64) << 2 * CELL_BITS
+        keys, counts = np.unique(keys | pack_cells(lat_cells, lon_cells), return_counts=True)
+        self.days = (keys >> 2 * CELL_BITS).astype(np.int16)
+        lat_cells, lon_cells = unpack_cells(keys)
+        self.lat_cells = lat_cells.astype(np.int16)
+        self.lon_cells = lon_cells.astype(np.int16)
+        self.counts = counts.astype(np.int32)
+
+    def to_arrays(self):
+        arrays = {
+            'days': self.days, 'lat_cells': self.lat_cells,
+            'lon_cells': self.lon_cells, 'counts': self.counts,
+        }
+        return arrays, {'south': self.south, 'west': self.west, 'step': self.step}
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        grid = cls.__new__(cls)
+        grid.south, grid.west, grid.step = meta['south'], meta['west'], meta['step']
+        for name, values in arrays.items():
+            setattr(grid, name, values)
+        return grid
+
+    @property
+    def nbytes(self):
+        return self.days.nbytes + self.lat_cells.nbytes + self.lon_cells.nbytes + self.counts.nbytes
+
+    def span(self, start_date, end_date):
+        i = np.searchsorted(self.days, start_date, side='left')
+        j = np.searchsorted(self.days, end_date, side='right')
+        return slice(i, max(i, j))
+
+    def cells(self, start_date, end_date, factor=1):
+        # Cell centres and detection counts over the date range at `factor`
+        # times the grid spacing.
+        rows = self.span(start_date, end_date)
+        keys = pack_cells(
+            self.lat_cells[rows].astype(np.int64) // factor,
+            self.lon_cells[rows].astype(np.int64) // factor,
+        )
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, weights=self.counts[rows]).astype(np.int64)
+        lat_cells, lon_cells = unpack_cells(keys)
+        size = factor * self.step
+        return (
+            self.south + (lat_cells + 0.5) * size,
+            self.west + (lon_cells + 0.5) * size,
+            counts,
+        )
@@ -0,0 +1,135 @@
+import numpy as np
+
+from date_index import to_days
+
+DAY_BITS = 20
+
+
+class FireIndex:
+    """Per-fire summaries of the fire-ID table behind an interval index.
+
+    Rows of the table (one per fire and day) are kept sorted by (fire, day),
+    with `day_keys` packing both into one sortable integer, so the days of a
+    fire within a date range are a binary-search slice.  Each fire also
+    gets its date span, union bounding box, size and the counties of all its
+    days joined into one label.  Fires are ordered by first day; because no
+    fire lasts longer than `max_duration`, the fires active in a range all
+    start within `max_duration` of it.
+    """
+
+    def __init__(self, df_fids):
+        df = df_fids.sort_values(['wildfire_id', 'date'], kind='mergesort')
+
+        ids, first = np.unique(df['wildfire_id'].to_numpy(), return_index=True)
+        self.ids = ids.astype(np.int32)
+        fire_pos = np.repeat(np.arange(len(self.ids)), np.diff(np.r_[first, len(df)]))
+        days = to_days(df['date'].to_numpy())
+        self.day_keys = (fire_pos << DAY_BITS) | days
+        self.lat_min = df['lat_min'].to_numpy(dtype=np.float32)
+        self.lat_max = df['lat_max'].to_numpy(dtype=np.float32)
+        self.long_min = df['long_min'].to_numpy(dtype=np.float32)
+        self.long_max = df['long_max'].to_numpy(dtype=np.float32)
+        self.sizes = (self.lat_max - self.lat_min) * (self.long_max - self.long_min)
+
+        # County labels are stored once in `label_names` and referenced by code
+        last = np.r_[first[1:], len(df)] - 1
+        row_labels = ['/'.join(county) if county else 'Unknown' for county in df['county']]
+        fire_labels = [
+            '/'.join(dict.fromkeys(c for county in df['county'].iloc[i:j + 1] for c in county)) or 'Unknown'
+            for i, j in zip(first, last)
+        ]
+        label_names, codes = np.unique(row_labels + fire_labels, return_inverse=True)
+        self.label_names = label_names.astype(object)
+        self.labels = codes[:len(row_labels)].astype(np.int32)
+        self.label = codes[len(row_labels):].astype(np.int32)
+
+        self.start, self.end = days[first], days[last]
+        self.bbox = {
+            'lat_min': np.minimum.reduceat(self.lat_min, first),
+            'lat_max': np.maximum.reduceat(self.lat_max, first),
+            'long_min': np.minimum.reduceat(self.long_min, first),
+            'long_max': np.maximum.reduceat(self.long_max, first),
+        }
+        self.size = (
+            (self.bbox['lat_max'] - self.bbox['lat_min']) *
+            (self.bbox['long_max'] - self.bbox['long_min'])
+        )
+
+        self.by_start = np.argsort(self.start, kind='mergesort')
+        self.starts = self.start[self.by_start]
+        self.max_duration = int((self.end - self.start).max()) if len(self.ids) else 0
+
+    ARRAYS = [
+        'ids', 'day_keys', 'lat_min', 'lat_max', 'long_min', 'long_max',
+        'sizes', 'labels', 'label', 'start', 'end', 'size', 'by_start', 'starts',
+    ]
+
+    def to_arrays(self):
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        arrays.update({'bbox.' + col: values for col, values in self.bbox.items()})
+        meta = {
+            'label_names': self.label_names.tolist(),
+            'max_duration': self.max_duration,
+        }
+        return arrays, meta
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        index = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(index, name, arrays[name])
+        index.bbox = {
+            name[len('bbox.'):]: values for name, values in arrays.items()
+            if name.startswith('bbox.')
+        }
+        index.label_names = np.array(meta['label_names'], dtype=object)
+        index.max_duration = meta['max_duration']
+        return index
+
+    @property
+    def nbytes(self):
+        arrays = [getattr(self, name) for name in self.ARRAYS] + list(self.bbox.values())
+        return sum(a.nbytes for a in arrays) + sum(len(name) for name in self.label_names)
+
+    def fire_days(self, fires, start_day, end_day):
+        # Row slices [lo, hi) of the given fire positions within the range
+        lo = np.searchsorted(self.day_keys, (fires << DAY_BITS) | start_day, side='left')
+        hi = np.searchsorted(self.day_keys, (fires << DAY_BITS) | end_day, side='right')
+        return lo, hi
+
+    def active(self, start_day, end_day):
+        # Positions of the fires with at least one day in the range
+        lo = np.searchsorted(self.starts, start_day - self.max_duration, side='left')
+        hi = np.searchsorted(self.starts, end_day, side='right')
+        fires = self.by_start[lo:hi]
+        fires = fires[self.end[fires] >= start_day]
+        days_lo, days_hi = self.fire_days(fires, start_day, end_day)
+        return fires[days_hi > days_lo], days_lo[days_hi > days_lo]
+
+    def options(self, start_day, end_day):
+        # {fire id: county label}, largest fires first.  A single day uses
+        # that day's box and counties, a range the summary of each fire.
+        fires, rows = self.active(start_day, end_day)
+        if start_day == end_day:
+            sizes, labels = self.sizes[rows], self.labels[rows]
+        else:
+            sizes, labels = self.size[fires], self.label[fires]
+        order = np.argsort(-sizes, kind='mergesort')
+        return dict(zip(self.ids[fires[order]].tolist(), self.label_names[labels[order]].tolist()))
+
+    def bounds(self, fire_id, start_day, end_day):
+        fire = np.searchsorted(self.ids, fire_id)
+        if fire == len(self.ids) or self.ids[fire] != fire_id:
+            return None
+        if start_day <= self.start[fire] and self.end[fire] <= end_day:
+            return {col: float(self.bbox[col][fire]) for col in self.bbox}
+        lo, hi = self.fire_days(np.array([fire]), start_day, end_day)
+        rows = slice(lo[0], hi[0])
+        if rows.stop <= rows.start:
+            return None
+        return {
+            'lat_min': float(self.lat_min[rows].min()),
+            'lat_max': float(self.lat_max[rows].max()),
+            'long_min': float(self.long_min[rows].min()),
+            'long_max': float(self.long_max[rows].max()),
+        }
@@ -1,50 +1,88 @@
-import ast
 import dash
 import dash_bootstrap_components as dbc
 import datetime
+import functools
 import gzip
 import json
 import math
 import numpy as np
 import os
-import pandas as pd
 import plotly.figure_factory as ff
 import plotly.graph_objects as go
-import sklearn.metrics
 from dash import dcc
 from dash import html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from dash_shap_components import ForcePlot
 
+import metrics
+from datasets import E, N, S, W, load_datasets, square_side_degrees, square_side_miles
+from date_index import to_dates, to_day
+from detection_grid import grid_refs, snap
+from prefetch import Prefetcher
+from shap_store import ShapStore
 
 
 DEFAULT_CONFIDENCE = 41
+SHAP_STORE_DIR = 'shap_store'
+SHAP_CACHE_SIZE = 512
+FIGURE_CACHE_SIZE = 64
+HIST_MAX_POINTS = 20000
+HIST_FULL_ZOOM = 10
+# Send the candidate prediction cells of a date once and apply the
+# confidence threshold in the browser (assets/predictions.js)
+CLIENTSIDE_FILTERING = True
+# Maps are sent the data within their view, extended by VIEWPORT_MARGIN of its
+# size on each side so that small pans need no update.  VIEWPORT_SIZE is the
+# map size in pixels assumed when the view is only known by center and zoom.
+VIEWPORT_MARGIN = 0.5
+VIEWPORT_SIZE = (1200, 900)
 MAP_CENTER = (39.926535, -121.629275)
+# Detections are given to COORD_DECIMALS decimals, which float32 holds closely
+# enough to round back to; predicted squares are snapped back onto the grid.
+COORD_DECIMALS = 5
+# After a date is shown the days either side of it are prepared in the
+# background, unless the worker's resident anonymous memory (not counting
+# the memory-mapped snapshot) is above the ceiling.
+PREFETCH_WORKERS = 1
+PREFETCH_MAX_RSS_MB = 300
 curdir = os.path.dirname(os.path.abspath(__file__))
-df = pd.read_csv(
-    os.path.join(curdir, 'modeling-2_historic_and_predictions.csv.gz'),
-    usecols=['latitude', 'longitude', 'date', 'type', 'Target', 'Pred'],
-    parse_dates=['date'],
-    dtype={'type': 'category'},
-)
-df_fids = pd.read_csv(
-    os.path.join(curdir, 'modeling-2_fire_ids.csv.gz'),
-    usecols=[
-        'wildfire_id', 'date', 'lat_min', 'lat_max', 'long_min', 'long_max',
-        'county'
-    ],
-    parse_dates=['date'],
-)
-df_fids['county'] = df_fids['county'].apply(ast.literal_eval)
-df_fids = df_fids.sort_values(['date'])
-with open('modeling-2_featureNames.txt') as f:
-    featureNames = f.read().splitlines()
+# The data files can be read from another directory, e.g. by benchmark.py
+data_dir = os.environ.get('APP_DATA_DIR', curdir)
+datasets = load_datasets(data_dir)
+data = datasets['data']
+confusion = datasets['confusion']
+detections = datasets['detections']
+fires = datasets['fires']
+tiles = datasets['tiles']
+if os.path.exists(os.path.join(data_dir, SHAP_STORE_DIR)):
+    shap_store = ShapStore(os.path.join(data_dir, SHAP_STORE_DIR))
+    featureNames = shap_store.feature_names
+else:
+    shap_store = None
+    with open('modeling-2_featureNames.txt') as f:
+        featureNames = f.read().splitlines()
 featureNames = {i:featureNames[i] for i in range(len(featureNames))}
 
-square_side_miles = 1
-miles_per_degree = 24901.461 / 360 # circumference of earth at equator divided by 360
-square_side_degrees = square_side_miles / miles_per_degree
 square_radius_deg = square_side_degrees / 2 - 0.000085
+SQUARE_LAT_OFFSETS = np.array([1, 1, -1, -1, 1]) * square_radius_deg
+SQUARE_LON_OFFSETS = np.array([1, -1, -1, 1, 1]) * square_radius_deg
+
+LAT_REFS = grid_refs(S, N, square_side_degrees)
+LON_REFS = grid_refs(W, E, square_side_degrees)
+
+def report_memory():
+    sizes = {
+        'display data': data.nbytes,
+        'confusion cube': confusion.nbytes,
+        'detection grid': detections.nbytes,
+        'fire index': fires.nbytes,
+        'tile index': tiles.nbytes,
+    }
+    for name, size in sizes.items():
+        print('Memory usage of {} is {:.2f} MB'.format(name, size / 1024**2))
+    print('Total resident data: {:.2f} MB'.format(sum(sizes.values()) / 1024**2))
+
+report_memory()
 
 # Sort the fire coordinates so that it forms a box
 def sort_fire(fire):
@@ -55,98 +93,214 @@ def sort_fire(fire):
 
     return fire
 
-def get_data(date, conf_thresh):
-    df_curr = df[(df['date'] == date) & (df['type'] == 'Historic')]
-    df_pred = df[
-        (df['date'] == date) &
-        (df['type'] == 'Prediction') &
-        (df['Pred'] >= conf_thresh)
-    ]
-    lats_curr, lons_curr = [], []
-    for row in df_curr.itertuples():
-        lats_curr.append(row.latitude)
-        lons_curr.append(row.longitude)
-    lats_pred, lons_pred, conf_pred, target_pred, shap_pred = [], [], [], [], []
-    for row in df_pred.itertuples():
-        lat, lon, conf, target, shap = row.latitude, row.longitude, row.Pred, row.Target, '{}_{}_{}'.format(row.date.strftime('%Y-%m-%d'), round(row.latitude,3), round(row.longitude,3))
-        lats_pred.append(lat + square_radius_deg)
-        lons_pred.append(lon + square_radius_deg)
-        lats_pred.append(lat + square_radius_deg)
-        lons_pred.append(lon - square_radius_deg)
-        lats_pred.append(lat - square_radius_deg)
-        lons_pred.append(lon - square_radius_deg)
-        lats_pred.append(lat - square_radius_deg)
-        lons_pred.append(lon + square_radius_deg)
-        lats_pred.append(lat + square_radius_deg)
-        lons_pred.append(lon + square_radius_deg)
-        conf_pred.extend([conf] * 5)
-        shap_pred.extend([shap] * 5)
-        target_pred.extend([target] * 5)
-        lats_pred.append(None)
-        lons_pred.append(None)
-        conf_pred.append(None)
-        shap_pred.append(None)
-        target_pred.append(None)
-    return (lats_curr, lons_curr), (lats_pred, lons_pred, conf_pred, target_pred, shap_pred)
-
-def get_hist_data(start_date, end_date):
-    df_curr = df[
-        (df['date'] >= start_date) &
-        (df['date'] <= end_date) &
-        (df['type'] == 'Historic')
-    ]
+def get_squares(lats, lons, *values):
+    # Every predicted cell is drawn as a closed five-vertex box followed by a
+    # None separator, so each cell contributes one row of six entries.
+    n = len(lats)
+    lats_sq = np.full((n, 6), None, dtype=object)
+    lons_sq = np.full((n, 6), None, dtype=object)
+    lats_sq[:, :5] = lats[:, None] + SQUARE_LAT_OFFSETS
+    lons_sq[:, :5] = lons[:, None] + SQUARE_LON_OFFSETS
+    values_sq = []
+    for value in values:
+        value_sq = np.full((n, 6), None, dtype=object)
+        value_sq[:, :5] = value[:, None]
+        values_sq.append(value_sq.ravel())
+    return (lats_sq.ravel(), lons_sq.ravel(), *values_sq)
+
+def get_shap_keys(days, lats, lons):
+    return np.char.add(
+        np.char.add(np.char.add(days, '_'), np.round(lats, 3).astype(str)),
+        np.char.add('_', np.round(lons, 3).astype(str)),
+    )
 
-    lats_curr, lons_curr = [], []
-    for row in df_curr.itertuples():
-        lats_curr.append(row.latitude)
-        lons_curr.append(row.longitude)
+def get_coords(rows):
+    return (
+        np.round(data['latitude'][rows].astype(np.float64), COORD_DECIMALS),
+        np.round(data['longitude'][rows].astype(np.float64), COORD_DECIMALS),
+    )
 
-    return (lats_curr, lons_curr), ()
+def count_rows(rows):
+    return rows.stop - rows.start if isinstance(rows, slice) else len(rows)
+
+# Rows of the date, only those in the tiles of `rect` if given
+def get_day_rows(date, rect=None):
+    if rect is None:
+        return data.day('Historic', date), data.day('Prediction', date)
+    day = to_day(date)
+    return tiles.query('Historic', day, day, rect), tiles.query('Prediction', day, day, rect)
+
+def get_data(date, conf, rect=None):
+    with metrics.stage('filter'):
+        if rect is None:
+            curr = data.day('Historic', date)
+            pred = data.above('Prediction', date, conf)
+        else:
+            curr, pred = get_day_rows(date, rect)
+            pred = pred[data['pred_bin'][pred] >= conf]
+        metrics.add_rows(count_rows(curr) + count_rows(pred))
+    with metrics.stage('geometry'):
+        lats = snap(data['latitude'][pred], LAT_REFS)
+        lons = snap(data['longitude'][pred], LON_REFS)
+        keys = get_shap_keys(np.datetime_as_string(to_dates(data['date'][pred])), lats, lons)
+        return (
+            get_coords(curr),
+            get_squares(lats, lons, data['Pred'][pred], data['Target'][pred], keys),
+        )
+
+# All predicted cells of the date, for filtering in the browser.  Confidence
+# bins are the slider positions a cell is shown at (see confidence_bins).
+def get_candidates(date, rect=None):
+    with metrics.stage('filter'):
+        curr, pred = get_day_rows(date, rect)
+        metrics.add_rows(count_rows(curr) + count_rows(pred))
+    with metrics.stage('geometry'):
+        lats = snap(data['latitude'][pred], LAT_REFS)
+        lons = snap(data['longitude'][pred], LON_REFS)
+        keys = get_shap_keys(np.datetime_as_string(to_dates(data['date'][pred])), lats, lons)
+        cells = {
+            'lat': lats.tolist(),
+            'lon': lons.tolist(),
+            'pred': data['Pred'][pred].astype(str).astype(np.float64).tolist(),
+            'pred_bin': data['pred_bin'][pred].tolist(),
+            'target': data['Target'][pred].tolist(),
+            'key': keys.tolist(),
+        }
+        return get_coords(curr), cells
+
+# Ranges with more than HIST_MAX_POINTS detections are sent as counts per grid
+# cell.  One cell is a 1 mile square at zoom HIST_FULL_ZOOM and doubles in size
+# for every zoom level below it, and again until at most HIST_MAX_POINTS
+# cells remain.
+def get_hist_data(start_date, end_date, zoom=6, rect=None):
+    with metrics.stage('filter'):
+        return filter_hist_data(start_date, end_date, zoom, rect)
+
+def filter_hist_data(start_date, end_date, zoom, rect):
+    start_day, end_day = to_day(start_date), to_day(end_date)
+    if rect is None:
+        curr = data.span('Historic', start_date, end_date)
+        if curr.stop - curr.start <= HIST_MAX_POINTS:
+            metrics.add_rows(curr.stop - curr.start)
+            return get_coords(curr), ()
+    elif tiles.count('Historic', start_day, end_day, rect) <= HIST_MAX_POINTS:
+        curr = tiles.query('Historic', start_day, end_day, rect)
+        metrics.add_rows(len(curr))
+        return get_coords(curr), ()
+
+    def get_cells(factor):
+        lats, lons, counts = detections.cells(start_day, end_day, factor)
+        metrics.add_rows(count_rows(detections.span(start_day, end_day)))
+        if rect is not None:
+            # Cells overlapping the tiles
+            south, north, west, east = tiles.tile_bbox(rect)
+            half = factor * square_side_degrees / 2
+            keep = (
+                (lats + half > south) & (lats - half < north) &
+                (lons + half > west) & (lons - half < east)
+            )
+            lats, lons, counts = lats[keep], lons[keep], counts[keep]
+        return lats, lons, counts
+
+    factor = 2 ** max(0, int(np.ceil(HIST_FULL_ZOOM - zoom)))
+    lats, lons, counts = get_cells(factor)
+    while len(counts) > HIST_MAX_POINTS:
+        factor *= 2
+        lats, lons, counts = get_cells(factor)
+
+    return (lats, lons, counts, factor), ()
 
 def get_eval_data(start_date, end_date, confidence):
-    df_eval = df[
-        (df['date'] >= start_date) &
-        (df['date'] <= end_date) &
-        (df['type'] == 'Prediction')
-    ]
-    y_pred = df_eval['Pred'].apply(lambda x: 1.0 if x >= confidence else 0.0)
+    with metrics.stage('filter'):
+        tp, fp, fn, tn = confusion.counts(to_day(start_date), to_day(end_date))
+        recall, precision, f1_score = confusion.scores(to_day(start_date), to_day(end_date))
+    confusion_matrix = [[tn[confidence], fp[confidence]], [fn[confidence], tp[confidence]]]
 
-    return df_eval['Target'], y_pred
+    return recall, precision, f1_score, confusion_matrix
 
-def get_fire_ids(start_date, end_date):
-    df_fids_curr = df_fids[
-        (df_fids['date'] >= start_date) &
-        (df_fids['date'] <= end_date)
-    ].copy()
-    df_fids_curr['size'] = (
-        (df_fids_curr['lat_max'] - df_fids_curr['lat_min']) *
-        (df_fids_curr['long_max'] - df_fids_curr['long_min'])
+def get_pr_curve(recall, precision, confidence):
+    thresholds = confusion.thresholds * 100
+    fig = go.Figure()
+    fig.add_scatter(
+        x=recall,
+        y=precision,
+        mode='lines',
+        customdata=thresholds,
+        hovertemplate='Confidence: %{customdata:.0f}%<br>Recall: %{x:.3f}<br>Precision: %{y:.3f}<extra></extra>',
+        name='Precision-Recall',
+    )
+    fig.add_scatter(
+        x=[recall[confidence]],
+        y=[precision[confidence]],
+        mode='markers',
+        marker={'color': 'red', 'size': 10},
+        hovertemplate='Selected confidence: {}%<extra></extra>'.format(confidence),
+        name='Selected confidence',
+    )
+    fig.update_layout(
+        title_text='<b>Precision-Recall Curve</b>',
+        xaxis={'title': 'Recall', 'range': [0, 1]},
+        yaxis={'title': 'Precision', 'range': [0, 1.05]},
+        showlegend=False,
     )
-    df_fids_curr = df_fids_curr.sort_values(['size'], ascending=False)
 
-    ids = {}
-    for row in df_fids_curr.itertuples():
-        ids[row.wildfire_id] = '/'.join(row.county) if row.county else 'Unknown'
+    return fig
 
-    return ids
+def get_fire_ids(start_date, end_date):
+    with metrics.stage('filter'):
+        options = fires.options(to_day(start_date), to_day(end_date))
+        metrics.add_rows(len(options))
+        return options
 
 def get_fire_data(fire_id, start_date, end_date):
-    data = df_fids[
-        (df_fids['wildfire_id'] == fire_id) &
-        (df_fids['date'] >= start_date) &
-        (df_fids['date'] <= end_date)
-    ]
-    if len(data) == 1:
-        return data.to_dict('records')[-1]
-    return {
-        'lat_min': data['lat_min'].min(),
-        'lat_max': data['lat_max'].max(),
-        'long_min': data['long_min'].min(),
-        'long_max': data['long_max'].max(),
-    }
+    return fires.bounds(fire_id, to_day(start_date), to_day(end_date))
+
+def get_view_bbox(center, zoom):
+    # (south, north, west, east) of a map of VIEWPORT_SIZE pixels; mapbox
+    # tiles are 512 pixels and span 360 degrees of longitude at zoom 0.
+    degrees = 360 / (512 * 2 ** zoom)
+    half_height = VIEWPORT_SIZE[1] / 2 * degrees * math.cos(math.radians(center[0]))
+    half_width = VIEWPORT_SIZE[0] / 2 * degrees
+    return (
+        center[0] - half_height, center[0] + half_height,
+        center[1] - half_width, center[1] + half_width,
+    )
 
-# Use plotly to make scatter plot for dataset description.
-def get_fire_map(curr, pred, fire_data):
+def get_viewport(relayout):
+    # Bounding box of the map after a pan or zoom, None for other relayouts
+    relayout = relayout or {}
+    if 'mapbox._derived' in relayout:
+        corners = relayout['mapbox._derived']['coordinates']
+        lats = [corner[1] for corner in corners]
+        lons = [corner[0] for corner in corners]
+        return min(lats), max(lats), min(lons), max(lons)
+    if 'mapbox.center' in relayout and 'mapbox.zoom' in relayout:
+        center = relayout['mapbox.center']
+        return get_view_bbox((center['lat'], center['lon']), relayout['mapbox.zoom'])
+    return None
+
+def get_view_rect(bbox):
+    # Tiles of the bounding box extended by VIEWPORT_MARGIN
+    height = bbox[1] - bbox[0]
+    width = bbox[3] - bbox[2]
+    return list(tiles.tile_rect((
+        bbox[0] - VIEWPORT_MARGIN * height, bbox[1] + VIEWPORT_MARGIN * height,
+        bbox[2] - VIEWPORT_MARGIN * width, bbox[3] + VIEWPORT_MARGIN * width,
+    )))
+
+def covers(rect, bbox):
+    # Whether the tiles of `rect` hold everything within the bounding box
+    if rect is None:
+        return False
+    inner = tiles.tile_rect(bbox)
+    if inner[0] > inner[1] or inner[2] > inner[3]:
+        return True
+    return (
+        rect[0] <= inner[0] and inner[1] <= rect[1] and
+        rect[2] <= inner[2] and inner[3] <= rect[3]
+    )
+
+def get_map_view(fire_data):
     if fire_data:
         center = (
             (fire_data['lat_min'] + fire_data['lat_max']) / 2,
@@ -165,6 +319,16 @@ def get_fire_map(curr, pred, fire_data):
         center = MAP_CENTER
         zoom = 6
 
+    return center, zoom
+
+# Use plotly to make scatter plot for dataset description.
+def get_fire_map(curr, pred, fire_data, uirevision=None):
+    with metrics.stage('figure'):
+        return build_fire_map(curr, pred, fire_data, uirevision)
+
+def build_fire_map(curr, pred, fire_data, uirevision):
+    center, zoom = get_map_view(fire_data)
+
     fig = go.Figure()
     if pred:
         fig.add_scattermapbox(
@@ -184,12 +348,27 @@ def get_fire_map(curr, pred, fire_data):
             name='Fire Prediction (Based on confidence threshold)',
         )
 
-    fig.add_scattermapbox(
-        lat=curr[0],
-        lon=curr[1],
-        marker={'color': 'red'},
-        name='Fire Burning',
-    )
+    if len(curr) > 2:
+        fig.add_scattermapbox(
+            lat=curr[0],
+            lon=curr[1],
+            marker={
+                'color': np.log10(curr[2]),
+                'colorscale': 'YlOrRd',
+                'cmin': 0,
+                'size': 8,
+            },
+            customdata=curr[2],
+            hovertemplate='(%{lat:.3f}°, %{lon:.3f}°)<br>Detections: %{customdata}<extra>Fire Burning</extra>',
+            name='Fire Burning (detections per {} mile square)'.format(curr[3] * square_side_miles),
+        )
+    else:
+        fig.add_scattermapbox(
+            lat=curr[0],
+            lon=curr[1],
+            marker={'color': 'red'},
+            name='Fire Burning',
+        )
 
     fig.update_layout(
         mapbox={
@@ -205,21 +384,35 @@ def get_fire_map(curr, pred, fire_data):
             'x': 0.01
         },
         margin={'l': 0, 'r': 0, 'b': 0, 't': 0},
+        uirevision=uirevision,
     )
 
     return fig
 
-def get_force_plot(key):
+# Recently decoded entries are kept so that clicking around one fire does not
+# go back to disk.  Falls back to the per-day gzip JSON files when no SHAP
+# store has been built.
+@functools.lru_cache(maxsize=SHAP_CACHE_SIZE)
+def get_shap(key):
+    if shap_store is not None:
+        return shap_store.get(key)
 
     date = key.split('_')[0]
     try:
-        with gzip.open('shap/shap_dict_{}.json.gz'.format(date)) as f:
+        with gzip.open(os.path.join(data_dir, 'shap', 'shap_dict_{}.json.gz'.format(date))) as f:
             shap_dict_full = json.load(f)
     except FileNotFoundError:
+        return None
+    return shap_dict_full.get(key)
+
+def get_force_plot(key):
+
+    with metrics.stage('shap'):
+        shap = get_shap(key)
+    if shap is None:
         return html.Div(
             'Sorry, SHAP force plot is not available for that date.'
         )
-    shap = shap_dict_full[key]
 
     return ForcePlot(
         baseValue=shap['baseValue'],
@@ -227,8 +420,45 @@ def get_force_plot(key):
         featureNames=featureNames,
     )
 
+def get_prediction_figure(date, conf, fire, rect=None):
+    return make_prediction_figure(str(date), conf, fire, rect and tuple(rect))
+
+@functools.lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def make_prediction_figure(date, conf, fire, rect):
+    fire_data = get_fire_data(fire, date, date) if fire else None
+    curr, pred = get_data(date, conf, rect)
+    return get_fire_map(curr, pred, fire_data, uirevision='{}/{}'.format(date, fire))
+
+def get_prediction_cells(date, fire, rect=None):
+    return make_prediction_cells(str(date), fire, rect and tuple(rect))
+
+@functools.lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def make_prediction_cells(date, fire, rect):
+    fire_data = get_fire_data(fire, date, date) if fire else None
+    curr, candidates = get_candidates(date, rect)
+    return {
+        'figure': get_fire_map(curr, None, fire_data, uirevision='{}/{}'.format(date, fire)),
+        'cells': candidates,
+        'lat_offsets': SQUARE_LAT_OFFSETS.tolist(),
+        'lon_offsets': SQUARE_LON_OFFSETS.tolist(),
+    }
+
+@functools.lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def get_day_fire_options(date):
+    return get_fire_options(get_fire_ids(date, date))
+
+def get_fire_options(fids):
+    options = [
+        {'label': '{} ({})'.format(fid, county), 'value': fid}
+        for fid, county in fids.items()
+    ]
+    placeholder = 'Please select a fire...'
+    if not options:
+        placeholder = 'No fire identifications available for selected date'
+    disabled = False if options else True
+    return options, placeholder, disabled
+
 def get_layout():
-    curr, pred = get_data('2021-07-01', DEFAULT_CONFIDENCE / 100)
     return html.Div([
         html.Div([
             html.Div(html.B('Quick Start')),
@@ -269,9 +499,11 @@ def get_layout():
                     'displayModeBar': True,
                     'modeBarButtonsToRemove': ['select2d', 'lasso2d'],
                 },
-                figure=get_fire_map(curr, pred, None),
+                figure=get_prediction_figure('2021-07-01', DEFAULT_CONFIDENCE, None),
             ),
         ], style={'padding': 10, 'flex': 1}),
+        dcc.Store(id='prediction-cells'),
+        dcc.Store(id='firemap-view'),
         html.Div([
             html.Div(id='force-plot-1'),
         ], style={'padding': 10, 'flex': 1}),
@@ -313,6 +545,7 @@ def get_history_layout():
                 figure=get_fire_map(([], []), None, None),
             ),
         ], style={'padding': 10, 'flex': 1}),
+        dcc.Store(id='hist-firemap-view'),
     ], style={'display': 'flex', 'flex-direction': 'column'})
 
 def get_eval_layout():
@@ -355,6 +588,13 @@ def get_eval_layout():
                 style={'display': 'none'},
             ),
         ], style={'padding': 10, 'flex': 1}),
+        html.Div([
+            dcc.Graph(
+                config={'displayModeBar': False},
+                id='pr-curve',
+                style={'display': 'none'},
+            ),
+        ], style={'padding': 10, 'flex': 1}),
     ], style={'display': 'flex', 'flex-direction': 'column'})
 
 external_stylesheets = [
@@ -366,45 +606,132 @@ dash_app = dash.Dash(
 )
 dash_app.config['suppress_callback_exceptions'] = True
 app = dash_app.server
+app.after_request(metrics.record_response)
+app.add_url_rule('/metrics', 'metrics', metrics.render)
+
+# The map data callbacks send what lies in the tiles around the map view and
+# keep those tiles in a store, so pans and zooms within them need no update.
+def get_prediction_view(trigger, date, fire, relayout, rect):
+    # (rect, whether the map needs new data)
+    if trigger == 'firemap':
+        viewport = get_viewport(relayout)
+        if viewport is None or covers(rect, viewport):
+            return rect, False
+        return get_view_rect(viewport), True
+    # A new date or fire resets the map to its initial view
+    fire_data = get_fire_data(fire, date, date) if fire else None
+    return get_view_rect(get_view_bbox(*get_map_view(fire_data))), True
+
+prefetcher = Prefetcher(PREFETCH_WORKERS, PREFETCH_MAX_RSS_MB * 1024**2)
+
+# Warms the caches for the previous and next day as the date picker would
+# show them, with no fire selected and the initial view.
+def prefetch_adjacent(date, conf=None):
+    rect = get_view_rect(get_view_bbox(*get_map_view(None)))
+    tasks = {}
+    for offset in (-1, 1):
+        day = str(datetime.date.fromisoformat(date[:10]) + datetime.timedelta(days=offset))
+        if CLIENTSIDE_FILTERING:
+            steps = [functools.partial(get_prediction_cells, day, None, rect)]
+        else:
+            steps = [functools.partial(get_prediction_figure, day, conf, None, rect)]
+        steps.append(functools.partial(get_day_fire_options, day))
+        if shap_store is not None:
+            steps.append(functools.partial(shap_store.warm, day))
+        tasks[(day, conf)] = steps
+    prefetcher.schedule(tasks)
+
+if CLIENTSIDE_FILTERING:
+    @dash_app.callback(
+        Output('fire-dropdown', 'options'),
+        Output('fire-dropdown', 'placeholder'),
+        Output('fire-dropdown', 'disabled'),
+        Output('fire-dropdown', 'value'),
+        Output('prediction-cells', 'data'),
+        Output('firemap-view', 'data'),
+        Input('date-picker', 'date'),
+        Input('fire-dropdown', 'value'),
+        Input('firemap', 'relayoutData'),
+        State('firemap-view', 'data'),
+    )
+    @metrics.instrument
+    def input_changed(date, fire, relayout, rect):
+        ctx = dash.callback_context
+        trigger = ctx.triggered[0]['prop_id'].split('.')[0]
+        fire_value = dash.no_update
+        if trigger == 'date-picker':
+            fire = None
+            fire_value = None
+
+        rect, changed = get_prediction_view(trigger, date, fire, relayout, rect)
+        if not changed:
+            raise dash.exceptions.PreventUpdate
+        if trigger == 'firemap':
+            options = placeholder = disabled = dash.no_update
+        else:
+            options, placeholder, disabled = get_day_fire_options(date)
+        cells = get_prediction_cells(date, fire, rect)
+        if trigger != 'firemap':
+            prefetch_adjacent(date)
+        return (
+            options,
+            placeholder,
+            disabled,
+            fire_value,
+            cells,
+            rect,
+        )
 
-@dash_app.callback(
-    Output('fire-dropdown', 'options'),
-    Output('fire-dropdown', 'placeholder'),
-    Output('fire-dropdown', 'disabled'),
-    Output('fire-dropdown', 'value'),
-    Output('firemap', 'figure'),
-    Input('date-picker', 'date'),
-    Input('conf-slider', 'value'),
-    Input('fire-dropdown', 'value'),
-)
-def input_changed(date, conf, fire):
-    ctx = dash.callback_context
-    trigger = ctx.triggered[0]['prop_id'].split('.')[0]
-    fire_value = dash.no_update
-    if trigger == 'date-picker':
-        fire = None
-        fire_value = None
-
-    fire_data = None
-    curr, pred = get_data(str(date), conf / 100)
-    fids = get_fire_ids(date, date)
-    if fire:
-        fire_data = get_fire_data(fire, date, date)
-    options = [
-        {'label': '{} ({})'.format(fid, county), 'value': fid}
-        for fid, county in fids.items()
-    ]
-    placeholder = 'Please select a fire...'
-    if not options:
-        placeholder = 'No fire identifications available for selected date'
-    disabled = False if options else True
-    return (
-        options,
-        placeholder,
-        disabled,
-        fire_value,
-        get_fire_map(curr, pred, fire_data),
+    dash_app.clientside_callback(
+        ClientsideFunction(namespace='predictions', function_name='filterCells'),
+        Output('firemap', 'figure'),
+        Input('prediction-cells', 'data'),
+        Input('conf-slider', 'value'),
     )
+else:
+    @dash_app.callback(
+        Output('fire-dropdown', 'options'),
+        Output('fire-dropdown', 'placeholder'),
+        Output('fire-dropdown', 'disabled'),
+        Output('fire-dropdown', 'value'),
+        Output('firemap', 'figure'),
+        Output('firemap-view', 'data'),
+        Input('date-picker', 'date'),
+        Input('conf-slider', 'value'),
+        Input('fire-dropdown', 'value'),
+        Input('firemap', 'relayoutData'),
+        State('firemap-view', 'data'),
+    )
+    @metrics.instrument
+    def input_changed(date, conf, fire, relayout, rect):
+        ctx = dash.callback_context
+        trigger = ctx.triggered[0]['prop_id'].split('.')[0]
+        fire_value = dash.no_update
+        if trigger == 'date-picker':
+            fire = None
+            fire_value = None
+
+        if trigger == 'conf-slider':
+            changed = True
+        else:
+            rect, changed = get_prediction_view(trigger, date, fire, relayout, rect)
+        if not changed:
+            raise dash.exceptions.PreventUpdate
+        if trigger in ('firemap', 'conf-slider'):
+            options = placeholder = disabled = dash.no_update
+        else:
+            options, placeholder, disabled = get_day_fire_options(date)
+        fig = get_prediction_figure(date, conf, fire, rect)
+        if trigger != 'firemap':
+            prefetch_adjacent(date, conf)
+        return (
+            options,
+            placeholder,
+            disabled,
+            fire_value,
+            fig,
+            rect,
+        )
 
 @dash_app.callback(
     Output('hist-fire-dropdown', 'options'),
@@ -412,11 +739,15 @@ def input_changed(date, conf, fire):
     Output('hist-fire-dropdown', 'disabled'),
     Output('hist-fire-dropdown', 'value'),
     Output('hist-firemap', 'figure'),
+    Output('hist-firemap-view', 'data'),
     Input('hist-date-picker', 'start_date'),
     Input('hist-date-picker', 'end_date'),
     Input('hist-fire-dropdown', 'value'),
+    Input('hist-firemap', 'relayoutData'),
+    State('hist-firemap-view', 'data'),
 )
-def hist_input_changed(start_date, end_date, fire):
+@metrics.instrument
+def hist_input_changed(start_date, end_date, fire, relayout, view):
     ctx = dash.callback_context
     trigger = ctx.triggered[0]['prop_id'].split('.')[0]
     fire_value = dash.no_update
@@ -427,24 +758,34 @@ def hist_input_changed(start_date, end_date, fire):
         raise dash.exceptions.PreventUpdate
 
     fire_data = None
-    curr, pred = get_hist_data(str(start_date), str(end_date))
-    fids = get_fire_ids(start_date, end_date)
     if fire:
         fire_data = get_fire_data(fire, start_date, end_date)
-    options = [
-        {'label': '{} ({})'.format(fid, county), 'value': fid}
-        for fid, county in fids.items()
-    ]
-    placeholder = 'Please select a fire...'
-    if not options:
-        placeholder = 'No fire identifications available for selected date'
-    disabled = False if options else True
+    center, zoom = get_map_view(fire_data)
+    viewport = get_view_bbox(center, zoom)
+    # The map keeps its view unless a fire is selected
+    if trigger != 'hist-fire-dropdown' and get_viewport(relayout) is not None:
+        viewport = get_viewport(relayout)
+        zoom = relayout.get('mapbox.zoom', zoom)
+    if trigger == 'hist-firemap':
+        # Only a zoom or leaving the tiles sent can change what is shown
+        if get_viewport(relayout) is None or (
+            view and view['zoom'] == zoom and covers(view['rect'], viewport)
+        ):
+            raise dash.exceptions.PreventUpdate
+    rect = get_view_rect(viewport)
+
+    curr, pred = get_hist_data(str(start_date), str(end_date), zoom, rect)
+    if trigger == 'hist-firemap':
+        options = placeholder = disabled = dash.no_update
+    else:
+        options, placeholder, disabled = get_fire_options(get_fire_ids(start_date, end_date))
     return (
         options,
         placeholder,
         disabled,
         fire_value,
-        get_fire_map(curr, pred, fire_data),
+        get_fire_map(curr, pred, fire_data, uirevision=str(fire)),
+        {'rect': rect, 'zoom': zoom},
     )
 
 @dash_app.callback(
@@ -455,6 +796,7 @@ def hist_input_changed(start_date, end_date, fire):
     State('clicks', 'data'),
     prevent_initial_call=True,
 )
+@metrics.instrument
 def map_clicked(clickData, clicks):
 
     if clickData is None:
@@ -479,39 +821,47 @@ def map_clicked(clickData, clicks):
     Output('precision', 'children'),
     Output('f1-score', 'children'),
     Output('confusion-matrix', 'figure'),
+    Output('pr-curve', 'style'),
+    Output('pr-curve', 'figure'),
     Input('eval-date-picker-range', 'start_date'),
     Input('eval-date-picker-range', 'end_date'),
     Input('eval-conf-slider', 'value'),
 )
+@metrics.instrument
 def eval_inputs_changed(start_date, end_date, confidence):
     if not start_date or not end_date or not confidence:
-        return {'display': 'none'}, {'display': 'none'}, '', '', '', go.Figure()
-
-    y_true, y_pred = get_eval_data(start_date, end_date, confidence / 100)
-    recall = sklearn.metrics.recall_score(y_true, y_pred)
-    precision = sklearn.metrics.precision_score(y_true, y_pred)
-    f1_score = sklearn.metrics.f1_score(y_true, y_pred)
-    confusion_matrix = sklearn.metrics.confusion_matrix(y_true, y_pred)
-
-    cm_fig = ff.create_annotated_heatmap(
-        x=['No fire', 'Fire'],
-        y=['No fire', 'Fire'],
-        z=confusion_matrix,
-    )
-    cm_fig.update_layout(
-        title_text='<b>Confusion Matrix</b>',
-        xaxis={'title': 'Prediction'},
-        yaxis={'title': 'Truth'},
+        return (
+            {'display': 'none'}, {'display': 'none'}, '', '', '', go.Figure(),
+            {'display': 'none'}, go.Figure(),
+        )
+
+    recall, precision, f1_score, confusion_matrix = get_eval_data(
+        start_date, end_date, confidence
     )
-    cm_fig['data'][0]['showscale'] = True
+
+    with metrics.stage('figure'):
+        cm_fig = ff.create_annotated_heatmap(
+            x=['No fire', 'Fire'],
+            y=['No fire', 'Fire'],
+            z=confusion_matrix,
+        )
+        cm_fig.update_layout(
+            title_text='<b>Confusion Matrix</b>',
+            xaxis={'title': 'Prediction'},
+            yaxis={'title': 'Truth'},
+        )
+        cm_fig['data'][0]['showscale'] = True
+        pr_fig = get_pr_curve(recall, precision, confidence)
 
     return (
         {'display': 'initial'},
         {'display': 'initial'},
-        '{:.3f}'.format(recall),
-        '{:.3f}'.format(precision),
-        '{:.3f}'.format(f1_score),
+        '{:.3f}'.format(recall[confidence]),
+        '{:.3f}'.format(precision[confidence]),
+        '{:.3f}'.format(f1_score[confidence]),
         cm_fig,
+        {'display': 'initial'},
+        pr_fig,
     )
 
 # the style arguments for the sidebar. We use position:fixed and a fixed width
@@ -566,6 +916,7 @@ dash_app.layout = html.Div([
     Output("page-content", "children"),
     [Input("url", "pathname")],
 )
+@metrics.instrument
 def render_page_content(pathname):
     if pathname == "/":
         with open('home.md') as f:
@@ -0,0 +1,122 @@
+import bisect
+import contextlib
+import functools
+import threading
+import time
+
+# Histograms of the callbacks served by this process, in the Prometheus text
+# format on /metrics.  Each gunicorn worker keeps its own counts.
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROWS_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+BYTES_BUCKETS = (1000, 10000, 100000, 300000, 1000000, 3000000, 10000000)
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, buckets, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labelnames = labelnames
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} histogram'.format(self.name),
+        ]
+        with self.lock:
+            series = {labels: (list(counts), n, total) for labels, (counts, n, total) in self.series.items()}
+        for labels, (counts, n, total) in sorted(series.items()):
+            pairs = ['{}="{}"'.format(name, value) for name, value in zip(self.labelnames, labels)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = ','.join(pairs + ['le="{}"'.format(bound)])
+                lines.append('{}_bucket{{{}}} {}'.format(self.name, le, cumulative))
+            label_text = '{' + ','.join(pairs) + '}' if pairs else ''
+            lines.append('{}_count{} {}'.format(self.name, label_text, n))
+            lines.append('{}_sum{} {}'.format(self.name, label_text, total))
+        return lines
+
+
+callback_seconds = Histogram(
+    'dash_callback_seconds', 'Wall time of Dash callbacks.',
+    SECONDS_BUCKETS, ('callback',),
+)
+stage_seconds = Histogram(
+    'dash_callback_stage_seconds', 'Wall time of the stages of Dash callbacks.',
+    SECONDS_BUCKETS, ('callback', 'stage'),
+)
+rows_scanned = Histogram(
+    'dash_callback_rows_scanned', 'Data rows read by Dash callbacks.',
+    ROWS_BUCKETS, ('callback',),
+)
+response_bytes = Histogram(
+    'dash_callback_response_bytes', 'Serialized response size of Dash callbacks.',
+    BYTES_BUCKETS, ('callback',),
+)
+HISTOGRAMS = [callback_seconds, stage_seconds, rows_scanned, response_bytes]
+
+# The callback being run by the current thread and the rows it has read
+local = threading.local()
+
+
+def instrument(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        local.callback = func.__name__
+        local.rows = 0
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            callback_seconds.observe(time.perf_counter() - start, func.__name__)
+            rows_scanned.observe(local.rows, func.__name__)
+            local.rows = None
+    return wrapper
+
+
+@contextlib.contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        callback = getattr(local, 'callback', None)
+        if callback is not None:
+            stage_seconds.observe(time.perf_counter() - start, callback, name)
+
+
+def add_rows(n):
+    if getattr(local, 'rows', None) is not None:
+        local.rows += int(n)
+
+
+def record_response(response):
+    # after_request hook of the Flask server: the size of the callback
+    # response, which Dash serializes after the callback has returned.
+    callback = getattr(local, 'callback', None)
+    if callback is not None:
+        if response.content_length is not None:
+            response_bytes.observe(response.content_length, callback)
+        local.callback = None
+    return response
+
+
+def render():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4'}
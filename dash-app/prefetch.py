@@ -0,0 +1,66 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def get_anon_rss():
+    # Resident anonymous memory of the process in bytes: the heap, without the
+    # pages of memory-mapped files, which the OS can reclaim.  None where
+    # /proc is missing.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+class Prefetcher:
+    """Warms caches from a small pool of background threads.
+
+    Each task is a list of steps (callables) under a key.  Scheduling a new
+    set of tasks cancels those whose key is not in it: tasks not started yet
+    are dropped and running ones stop before their next step.  No step is
+    started while the resident anonymous memory of the process is above
+    `max_rss` bytes.
+    """
+
+    def __init__(self, workers, max_rss):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self.max_rss = max_rss
+        self.tasks = {}
+        self.lock = threading.Lock()
+
+    def schedule(self, tasks):
+        with self.lock:
+            for key, (token, future) in list(self.tasks.items()):
+                if key not in tasks:
+                    future.cancel()
+                    del self.tasks[key]
+                elif future.done():
+                    del self.tasks[key]
+            for key, steps in tasks.items():
+                if key not in self.tasks:
+                    token = object()
+                    self.tasks[key] = token, self.executor.submit(self.run, key, token, steps)
+
+    def wanted(self, key, token):
+        with self.lock:
+            return key in self.tasks and self.tasks[key][0] is token
+
+    def run(self, key, token, steps):
+        for step in steps:
+            if not self.wanted(key, token):
+                return
+            rss = get_anon_rss()
+            if rss is not None and rss > self.max_rss:
+                return
+            try:
+                step()
+            except Exception:
+                logger.exception('Prefetch of %s failed', key)
+                return
@@ -0,0 +1,76 @@
+import json
+import os
+
+import numpy as np
+
+# On-disk layout written by display.write_shap_store:
+#   index.npy          one record per SHAP key, sorted by key code
+#   entries.bin        packed (feature, effect, value) records of all keys
+#   feature_names.json feature table shared by every entry
+SHAP_INDEX_DTYPE = np.dtype([
+    ('key', '<i8'), ('start', '<i8'), ('stop', '<i8'), ('base_value', '<f8'),
+])
+SHAP_ENTRY_DTYPE = np.dtype([
+    ('feature', '<i2'), ('effect', '<f4'), ('value', '<f4'),
+])
+SHAP_INDEX_BLOCK = 1024
+
+
+def shap_key_code(key):
+    # '<date>_<lat>_<lon>' -> day number and coordinates in thousandths of a
+    # degree packed into a single sortable integer.
+    date, lat, lon = key.split('_')
+    day = int(np.datetime64(date, 'D').astype(np.int64))
+    lat = int(round(float(lat) * 1000)) + 2**19
+    lon = int(round(float(lon) * 1000)) + 2**19
+    return (day << 40) | (lat << 20) | lon
+
+
+class ShapStore:
+
+    def __init__(self, path):
+        # Both files are mapped read-only and shared between worker processes;
+        # only the first key of every SHAP_INDEX_BLOCK records is held in
+        # memory, so a lookup reads one block of the index.
+        self.index = np.load(os.path.join(path, 'index.npy'), mmap_mode='r')
+        self.fence = np.array(self.index['key'][::SHAP_INDEX_BLOCK])
+        self.entries = np.memmap(
+            os.path.join(path, 'entries.bin'), dtype=SHAP_ENTRY_DTYPE, mode='r'
+        )
+        with open(os.path.join(path, 'feature_names.json')) as f:
+            self.feature_names = json.load(f)
+
+    def warm(self, date):
+        # Reads the index blocks holding the keys of a date, so that lookups
+        # on that date find them in the page cache.
+        day = int(np.datetime64(date, 'D').astype(np.int64))
+        first = max(np.searchsorted(self.fence, day << 40, side='right') - 1, 0)
+        last = np.searchsorted(self.fence, (day + 1) << 40, side='left')
+        return len(np.array(self.index[first * SHAP_INDEX_BLOCK:last * SHAP_INDEX_BLOCK]))
+
+    def get(self, key):
+        code = shap_key_code(key)
+        block = np.searchsorted(self.fence, code, side='right') - 1
+        if block < 0:
+            return None
+        start = block * SHAP_INDEX_BLOCK
+        keys = self.index['key'][start:start + SHAP_INDEX_BLOCK]
+        i = np.searchsorted(keys, code)
+        if i == len(keys) or keys[i] != code:
+            return None
+        record = self.index[start + i]
+        rows = self.entries[record['start']:record['stop']]
+        # float32 values are printed at their shortest repr so the force plot
+        # shows e.g. 98.04 rather than 98.04000091552734.
+        values = rows['value'].astype(str).astype(np.float64)
+        return {
+            'baseValue': float(record['base_value']),
+            'features': {
+                str(feature): {'effect': effect, 'value': value}
+                for feature, effect, value in zip(
+                    rows['feature'].tolist(),
+                    rows['effect'].tolist(),
+                    values.tolist(),
+                )
+            },
+        }
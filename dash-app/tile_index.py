@@ -0,0 +1,113 @@
+import numpy as np
+
+TILE_BITS = 10
+TILE_OFFSET = 2**9
+DAY_BITS = 16
+
+
+def pack_tiles(lat_tiles, lon_tiles):
+    return ((lat_tiles + TILE_OFFSET) << TILE_BITS) | (lon_tiles + TILE_OFFSET)
+
+
+class TileIndex:
+    """Rows of a DateIndex grouped by map tile, for viewport queries.
+
+    Tiles are squares of `tile_cells` x `tile_cells` cells of the modeling
+    grid, numbered from its (south, west) corner.  For each type the row
+    numbers are sorted by (tile, day), with `keys` packing both into one
+    integer, so the rows of one tile within a date range are a binary-search
+    slice and a bounding box is one slice per tile it overlaps.
+    """
+
+    def __init__(self, index, south, west, step, tile_cells=16):
+        self.south, self.west = south, west
+        self.size = step * tile_cells
+        self.keys = {}
+        self.rows = {}
+        for kind in index.partitions:
+            rows = index.rows(kind)
+            lat_tiles, lon_tiles = self.tile_of(index['latitude'][rows], index['longitude'][rows])
+            keys = pack_tiles(lat_tiles, lon_tiles) << DAY_BITS | index[index.date_col][rows].astype(np.int64)
+            order = np.argsort(keys, kind='mergesort')
+            self.keys[kind] = keys[order]
+            self.rows[kind] = (order + rows.start).astype(np.int32)
+
+        # Tile ranges holding any rows, which bound every query
+        lat_tiles, lon_tiles = self.tile_of(index['latitude'], index['longitude'])
+        self.extent = [
+            int(lat_tiles.min()), int(lat_tiles.max()),
+            int(lon_tiles.min()), int(lon_tiles.max()),
+        ] if len(lat_tiles) else [0, -1, 0, -1]
+
+    def to_arrays(self):
+        arrays = {}
+        for kind in self.keys:
+            arrays['keys.' + kind] = self.keys[kind]
+            arrays['rows.' + kind] = self.rows[kind]
+        meta = {
+            'south': self.south, 'west': self.west, 'size': self.size,
+            'extent': self.extent, 'kinds': list(self.keys),
+        }
+        return arrays, meta
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        index = cls.__new__(cls)
+        index.south, index.west, index.size = meta['south'], meta['west'], meta['size']
+        index.extent = meta['extent']
+        index.keys = {kind: arrays['keys.' + kind] for kind in meta['kinds']}
+        index.rows = {kind: arrays['rows.' + kind] for kind in meta['kinds']}
+        return index
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.keys.values()) + sum(a.nbytes for a in self.rows.values())
+
+    def tile_of(self, lats, lons):
+        lat_tiles = np.floor((np.asarray(lats, dtype=np.float64) - self.south) / self.size)
+        lon_tiles = np.floor((np.asarray(lons, dtype=np.float64) - self.west) / self.size)
+        return (
+            np.clip(lat_tiles, -TILE_OFFSET, TILE_OFFSET - 1).astype(np.int64),
+            np.clip(lon_tiles, -TILE_OFFSET, TILE_OFFSET - 1).astype(np.int64),
+        )
+
+    def tile_rect(self, bbox):
+        # (south, north, west, east) in degrees -> inclusive tile ranges,
+        # limited to the extent of the rows
+        (south, north), (west, east) = self.tile_of(bbox[:2], bbox[2:])
+        return (
+            max(int(south), self.extent[0]), min(int(north), self.extent[1]),
+            max(int(west), self.extent[2]), min(int(east), self.extent[3]),
+        )
+
+    def tile_bbox(self, rect):
+        # Inclusive tile ranges -> (south, north, west, east) in degrees
+        return (
+            self.south + rect[0] * self.size,
+            self.south + (rect[1] + 1) * self.size,
+            self.west + rect[2] * self.size,
+            self.west + (rect[3] + 1) * self.size,
+        )
+
+    def slices(self, kind, start_day, end_day, rect):
+        if kind not in self.keys:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        lat_tiles, lon_tiles = np.meshgrid(
+            np.arange(rect[0], rect[1] + 1), np.arange(rect[2], rect[3] + 1), indexing='ij'
+        )
+        tiles = pack_tiles(lat_tiles.ravel(), lon_tiles.ravel()) << DAY_BITS
+        lo = np.searchsorted(self.keys[kind], tiles | start_day, side='left')
+        hi = np.searchsorted(self.keys[kind], tiles | end_day, side='right')
+        # A reversed date range is empty
+        return lo, np.maximum(hi, lo)
+
+    def count(self, kind, start_day, end_day, rect):
+        lo, hi = self.slices(kind, start_day, end_day, rect)
+        return int((hi - lo).sum())
+
+    def query(self, kind, start_day, end_day, rect):
+        # Row numbers of the DateIndex in the tiles and date range, in row order
+        lo, hi = self.slices(kind, start_day, end_day, rect)
+        lengths = hi - lo
+        positions = np.repeat(lo - np.r_[0, np.cumsum(lengths)[:-1]], lengths) + np.arange(lengths.sum())
+        return np.sort(self.rows[kind][positions])
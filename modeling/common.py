@@ -1,10 +1,15 @@
 import pandas as pd
 import datetime
 import math
-import dask.dataframe as dd
 import gcsfs
+import glob
+import hashlib
 import json
 import numpy as np
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 S = 37.25411
 N = 42.59896
@@ -23,9 +28,27 @@ if local == True:
 
 folder = '{}/modeling-2'.format(GCS_PREFIX)
 
+DAILY_FILES = '{}/nasa-firms/suomi-npp-viirs-c2/*.txt'.format(GCS_PREFIX)
+DAILY_START_DATE = '2022-01-01'
+
+# labelled_1Mile, modeling_df, X_test_thresh{1,2} and historic_and_predictions
+# are parquet datasets with a directory of files per DATE_BLOCK_DAYS date ids
+DATE_BLOCK_DAYS = 100
+
 WEATHER_METRICS = ['precipIntensity', 'precipIntensityMax', 'temperatureHigh', 'temperatureLow',
                    'humidity', 'windSpeed', 'windGust', 'windBearing', 'cloudCover', 'windSpeedSquared']
 
+# Columns read from the raw FIRMS and DarkSky files, in the order returned
+ARCHIVE_DTYPES = {'latitude': np.float64, 'longitude': np.float64, 'acq_date': str, 'acq_time': np.int64,
+                  'brightness': np.float64}
+DAILY_DTYPES = {'latitude': np.float64, 'longitude': np.float64, 'acq_date': str, 'acq_time': str}
+WEATHER_DTYPES = dict({'Date': str, 'Lat': np.float64, 'Long': np.float64},
+                      **{metric: np.float64 for metric in WEATHER_METRICS[:-1]})
+
+# Local directory of the filtered raw files, and threads reading them
+RAW_CACHE_DIR = 'raw_cache'
+RAW_READ_WORKERS = 8
+
 def get_ref_dictionaries(reverse = False):
 
     step = square_side_degrees
@@ -72,76 +95,228 @@ def get_ref_dictionaries(reverse = False):
         return lat_refs, long_refs, date_ids
 
 
-def get_weather_coords():
+def get_weather_offsets():
 
-    coords = []
+    offsets = []
 
     for x in range(-2, 2 + 1):
         for y in range(-2, 2 + 1):
 
             if (math.sqrt(x**2 + y**2) <= 4) & (x % 2 == 0) & (y % 2 == 0):
-                coords.append(str((x,y,0)))
-                coords.append(str((x,y,1)))
+                offsets.append((x, y, 0))
+                offsets.append((x, y, 1))
 
-    return coords
+    return np.array(offsets, dtype=np.int64)
 
-def get_neighbor_coords(fire_spread_thresh, dates_back = 0):
+def get_weather_coords():
 
-    coords = []
+    return [str(tuple(offset)) for offset in get_weather_offsets().tolist()]
+
+def get_neighbor_offsets(fire_spread_thresh, dates_back = 0):
+
+    offsets = []
 
     for x in range(-fire_spread_thresh, fire_spread_thresh + 1):
         for y in range(-fire_spread_thresh, fire_spread_thresh + 1):
 
             if math.sqrt(x**2 + y**2) <= fire_spread_thresh:
                 if not dates_back:
-                    coords.append(str((x,y)))
+                    offsets.append((x, y))
                 else:
                     for d in range(dates_back + 1):
-                        coords.append(str((x, y, -d)))
+                        offsets.append((x, y, -d))
 
-    return coords
+    return np.array(offsets, dtype=np.int64)
 
+def get_neighbor_coords(fire_spread_thresh, dates_back = 0):
 
-def get_historic_raw():
-    historic_archive1 = pd.read_csv('{}/nasa_archive/fire_archive_SV-C2_233133.csv'.format(GCS_PREFIX))
-    historic_archive2 = pd.read_csv('{}/nasa_archive/fire_archive_SV-C2_246698.csv'.format(GCS_PREFIX))
+    return [str(tuple(offset)) for offset in get_neighbor_offsets(fire_spread_thresh, dates_back).tolist()]
 
-    historic_archive = historic_archive1.append(historic_archive2)
 
-    del (historic_archive1)
-    del (historic_archive2)
+def pack_keys(columns):
+    # Packs columns of non-negative integers into one int64 per row, the first
+    # column in the highest bits, so rows compare, sort and dedup as integers
+    key = np.zeros(len(columns[0]), dtype=np.int64)
+    bits = 0
+    for column in columns:
+        column = np.asarray(column, dtype=np.int64)
+        width = int(column.max()).bit_length() if len(column) else 0
+        bits += width
+        key = (key << width) | column
+    if bits > 63:
+        raise ValueError('Keys need {} bits, more than fit in an int64'.format(bits))
+    return key
 
-    historic_archive = historic_archive[['latitude', 'longitude', 'acq_date', 'acq_time', 'brightness']]
+
+def get_historic_raw():
+    historic_archive = read_raw_csvs(['{}/nasa_archive/fire_archive_SV-C2_233133.csv'.format(GCS_PREFIX),
+                                      '{}/nasa_archive/fire_archive_SV-C2_246698.csv'.format(GCS_PREFIX)],
+                                     ARCHIVE_DTYPES, bbox=True)
     historic_archive = historic_archive.drop_duplicates(keep='last')
 
-    historic_daily = dd.read_csv('{}/nasa-firms/suomi-npp-viirs-c2/*.txt'.format(GCS_PREFIX))
-    historic_daily = historic_daily.compute()
-    historic_daily = historic_daily[['latitude', 'longitude', 'acq_date', 'acq_time']]
-    historic_daily = historic_daily[historic_daily.acq_date >= '2022-01-01']
+    historic_daily = get_daily_raw(list_files(DAILY_FILES))
 
-    historic = historic_archive.append(historic_daily)
+    return pd.concat([historic_archive, historic_daily])
 
-    return historic
 
+def get_daily_raw(files):
 
-def get_weather_raw():
+    return read_raw_csvs(files, DAILY_DTYPES, bbox=True, start_date=DAILY_START_DATE)
+
+
+def read_raw_csvs(paths, dtype, **kwargs):
+    # read_raw_csv of each file, RAW_READ_WORKERS at a time, concatenated in order
+    with ThreadPoolExecutor(max_workers=RAW_READ_WORKERS) as executor:
+        dfs = list(executor.map(lambda path: read_raw_csv(path, dtype, **kwargs), paths))
+
+    return pd.concat(dfs) if dfs else pd.DataFrame(columns=list(dtype))
+
+
+def read_raw_csv(path, dtype, bbox=False, start_date=None, dropna=False, cache_dir=RAW_CACHE_DIR):
+    # The dtype columns of a raw file, keeping rows inside the NorCal bounding
+    # box, from start_date and without missing values as asked, a million
+    # rows at a time.  The result is cached in cache_dir until the size or
+    # modification time of the file changes.
+    stamp = {'source': get_file_stamp(path), 'columns': list(dtype), 'bbox': [S, N, E, W] if bbox else None,
+             'start_date': start_date, 'dropna': dropna}
+    if cache_dir is not None:
+        cache = '{}/{}'.format(cache_dir, hashlib.sha1(path.encode()).hexdigest())
+        if read_json(cache + '.json') == stamp:
+            return pd.read_parquet(cache + '.parquet')
+
+    chunks = []
+    for chunk in pd.read_csv(path, usecols=list(dtype), dtype=dtype, chunksize=10**6):
+        chunk = chunk[list(dtype)]
+        if bbox:
+            chunk = chunk[(chunk.latitude >= S) & (chunk.latitude <= N) & (chunk.longitude >= W) &
+                          (chunk.longitude <= E)]
+        if start_date is not None:
+            chunk = chunk[chunk.acq_date >= start_date]
+        if dropna:
+            chunk = chunk.dropna()
+        chunks.append(chunk)
+    df = pd.concat(chunks) if chunks else pd.DataFrame(columns=list(dtype))
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        df.to_parquet(cache + '.parquet', index=True)
+        write_json(stamp, cache + '.json')
+
+    return df
+
+
+def get_file_stamp(path):
+
+    if 'gs://' in path:
+        info = gcsfs.GCSFileSystem().info(path)
+        return [info['size'], str(info.get('updated', info.get('mtime')))]
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def list_files(pattern):
 
-    df1 = pd.read_csv('{}/weather/darksky_points_thresh1_withValues.csv'.format(GCS_PREFIX))
-    df2 = pd.read_csv('{}/weather/darksky_thresh2minus1.csv'.format(GCS_PREFIX))
-    df3 = pd.read_csv('{}/weather/darksky_remaining_results.csv'.format(GCS_PREFIX))
+    if 'gs://' in pattern:
+        fs = gcsfs.GCSFileSystem()
+        return sorted('gs://' + path for path in fs.glob(pattern))
+    return sorted(glob.glob(pattern))
+
+
+def read_json(path):
+
+    if 'gs://' in path:
+        fs = gcsfs.GCSFileSystem()
+        if not fs.exists(path):
+            return None
+        with fs.open(path) as file:
+            return json.load(file)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_json(obj, path):
+
+    if 'gs://' in path:
+        fs = gcsfs.GCSFileSystem()
+        with fs.open(path, 'w') as file:
+            json.dump(obj, file)
+    else:
+        with open(path, 'w') as file:
+            json.dump(obj, file)
+
+
+def write_dataset(df, path, append=False, name=None):
+    # Writes df to a dataset directory, each row under date_block=<date_id //
+    # DATE_BLOCK_DAYS>, replacing the dataset unless appending.  The files are
+    # named `name`, by default the time written, and replace those of the
+    # same name.  Numbers are widened so that every file of a dataset has the
+    # same schema, whatever reduce_mem_usage made of the frame it was written
+    # from.
+    if not append:
+        remove_dataset(path)
+    elif name is not None:
+        remove_files('{}/date_block=*/{}.parquet'.format(path, name))
+
+    df = df.infer_objects()
+    df = df.astype({col: np.int64 if df[col].dtype.kind in 'iu' else np.float64
+                    for col in df.columns if df[col].dtype.kind in 'iuf'})
+
+    name = '{}.parquet'.format(time.time_ns() if name is None else name)
+    for block, part in df.groupby(df.date_id.to_numpy() // DATE_BLOCK_DAYS):
+        directory = '{}/date_block={:04d}'.format(path, block)
+        if 'gs://' not in path:
+            os.makedirs(directory, exist_ok=True)
+        part.to_parquet('{}/{}'.format(directory, name), index=True)
 
-    df = df1.append(df2).append(df3)
 
-    del(df1)
-    del(df2)
-    del(df3)
+def read_dataset(path, columns=None, first_date_id=None, last_date_id=None):
+    # Reads the given columns of the rows of a dataset from first_date_id to
+    # last_date_id, opening only the date blocks that hold them.  A dataset
+    # without files is empty.
+    if not list_files('{}/date_block=*/*.parquet'.format(path)):
+        return pd.DataFrame(columns=columns)
 
-    df = df[['Date', 'Lat', 'Long', 'precipIntensity', 'precipIntensityMax', 'temperatureHigh', 'temperatureLow',
-             'humidity', 'windSpeed', 'windGust', 'windBearing', 'cloudCover']].dropna()
+    filters = []
+    if first_date_id is not None:
+        filters += [('date_block', '>=', first_date_id // DATE_BLOCK_DAYS), ('date_id', '>=', first_date_id)]
+    if last_date_id is not None:
+        filters += [('date_block', '<=', last_date_id // DATE_BLOCK_DAYS), ('date_id', '<=', last_date_id)]
+
+    df = pd.read_parquet(path, columns=columns, filters=filters or None)
+
+    return df.drop(columns=['date_block'], errors='ignore')
+
+
+def remove_files(pattern):
+
+    if 'gs://' in pattern:
+        fs = gcsfs.GCSFileSystem()
+        for path in list_files(pattern):
+            fs.rm(path)
+    else:
+        for path in list_files(pattern):
+            os.remove(path)
+
+
+def remove_dataset(path):
+
+    if 'gs://' in path:
+        fs = gcsfs.GCSFileSystem()
+        if fs.exists(path):
+            fs.rm(path, recursive=True)
+    elif os.path.exists(path):
+        shutil.rmtree(path)
+
+
+def get_weather_raw():
 
-    df['windSpeedSquared'] = df['windSpeed'].apply(lambda x: x**2)
+    df = read_raw_csvs(['{}/weather/darksky_points_thresh1_withValues.csv'.format(GCS_PREFIX),
+                        '{}/weather/darksky_thresh2minus1.csv'.format(GCS_PREFIX),
+                        '{}/weather/darksky_remaining_results.csv'.format(GCS_PREFIX)], WEATHER_DTYPES, dropna=True)
 
-    df['Date'] = df['Date'].astype(str)
+    df['windSpeedSquared'] = df['windSpeed'] ** 2
 
     return df
 
@@ -1,10 +1,12 @@
 import pandas as pd
 import numpy as np
+import collections
 import datetime
 import math
 import multiprocessing
 import gcsfs
 import json
+import os
 import pytz
 
 import common
@@ -16,111 +18,252 @@ lat_refs_reverse, long_refs_reverse, date_ids_reverse = common.get_ref_dictionar
 
 step = common.square_side_degrees
 
-def get_refs(df, step, coords, coord_refs, coord_string, coord_ref_string, coord_ref_id_string, buffer):
-    for coord in coords:
-        print(coord, min(coords), max(coords))
-        refs_to_check = {k: coord_refs[k] for k in coord_refs if
-                         (coord < coord_refs[k] + step) & (coord > coord_refs[k] - step)}
-        if refs_to_check:
-            for ID in refs_to_check:
-                coord_ref = refs_to_check[ID]
-                if abs(coord - coord_ref) < step/2:
-                    df.loc[df[coord_string] == coord, coord_ref_string] = coord_ref
-                    df.loc[df[coord_string] == coord, coord_ref_id_string] = ID
-                    break
-        else:
-            dist_to_min_coord_ref = abs(coord - coord_refs[min(coord_refs)])
-            dist_to_max_coord_ref = abs(coord - coord_refs[max(coord_refs)])
-            if dist_to_min_coord_ref < dist_to_max_coord_ref:
-                df.loc[df[coord_string] == coord, coord_ref_string] = coord_refs[min(coord_refs)]
-                df.loc[df[coord_string] == coord, coord_ref_id_string] = min(coord_refs)
-            else:
-                df.loc[df[coord_string] == coord, coord_ref_string] = coord_refs[max(coord_refs)]
-                df.loc[df[coord_string] == coord, coord_ref_id_string] = max(coord_refs)
+# Local directory of the memory-mapped weather array of prepare_weather_predictors
+WEATHER_CUBE_DIR = 'weather_cube'
+# Days before a date that its features read detections from, the furthest
+# date offset of prepare_nasa_predictors
+LOOK_BACK_DAYS = 2
+# prepare_for_modeling builds the features of as many dates at a time as fit
+# in this many MB, or of all dates at once if None
+MEMORY_BUDGET_MB = 4096
+# Processes among which prepare_for_modeling splits the dates
+WORKERS = multiprocessing.cpu_count()
+# Copies of a modeling row held while its features are built, by the concat
+# of the feature columns and reduce_mem_usage
+FEATURE_COPIES = 3
+
+def snap_refs(values, coord_refs, step):
+    # Grid reference and id of each value: the first reference within step / 2
+    # of it, NaN if there is none but one is within step, and the nearer of
+    # the first and last reference otherwise.
+    ids = np.array(list(coord_refs))
+    refs = np.array(list(coord_refs.values()), dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+
+    upper = np.minimum(np.searchsorted(refs, values), len(refs) - 1)
+    lower = np.maximum(upper - 1, 0)
+    near_lower = np.abs(values - refs[lower]) < step / 2
+    near_upper = np.abs(values - refs[upper]) < step / 2
+    in_range = ((values < refs[lower] + step) & (values > refs[lower] - step)) | (
+            (values < refs[upper] + step) & (values > refs[upper] - step))
+    clamped = np.where(np.abs(values - refs[0]) < np.abs(values - refs[-1]), 0, len(refs) - 1)
+
+    index = np.where(near_lower, lower, np.where(near_upper, upper, clamped))
+    found = near_lower | near_upper | ~in_range
+    return np.where(found, refs[index], np.nan), np.where(found, ids[index], np.nan)
+
+def get_grid_refs():
+    lat_refs = np.arange(common.S, common.N, step)[:-1] + step / 2
+    long_refs = np.arange(common.W, common.E, step)[:-1] + step / 2
+
+    lat_refs = dict(zip(range(1, len(lat_refs) + 1), lat_refs))
+    long_refs = dict(zip(range(1, len(long_refs) + 1), long_refs))
+
+    return lat_refs, long_refs
+
+def assign_refs(df, lat_refs, long_refs):
+    lat_ref, lat_ref_id = snap_refs(df['latitude_rounded'], lat_refs, step)
+    long_ref, long_ref_id = snap_refs(df['longitude_rounded'], long_refs, step)
+    df['lat_ref'] = lat_ref
+    df['long_ref'] = long_ref
+    df['lat_ref_id'] = lat_ref_id
+    df['long_ref_id'] = long_ref_id
+
+    # Rounded values that fall between two references are snapped unrounded
+    remaining = df['lat_ref'].isna()
+    df.loc[remaining, 'lat_ref'], df.loc[remaining, 'lat_ref_id'] = snap_refs(
+        df.loc[remaining, 'latitude'], lat_refs, step)
+    remaining = df['long_ref'].isna()
+    df.loc[remaining, 'long_ref'], df.loc[remaining, 'long_ref_id'] = snap_refs(
+        df.loc[remaining, 'longitude'], long_refs, step)
 
     return df
 
+def parse_acq_datetimes(acq_date, acq_time):
+    # Batched common.convert_to_datetime.  acq_time is HHMM without leading
+    # zeros in the archive and 'HH:MM' in the daily files.
+    date_codes, dates = pd.factorize(acq_date)
+    dates = pd.to_datetime(dates, format='%Y-%m-%d')
+
+    times = pd.to_numeric(acq_time, errors='coerce').to_numpy(dtype=np.float64)
+    text = np.isnan(times)
+    times[text] = pd.to_numeric(pd.Series(acq_time.to_numpy()[text], dtype=str).str.replace(':', '', regex=False))
+    times = times.astype(np.int64)
+    minutes = times // 100 * 60 + times % 100
+
+    return (dates[date_codes] + pd.to_timedelta(minutes, unit='m')).to_numpy()
+
+def round_values(values, decimals):
+    # Python's round() of every distinct value; np.round differs from it on
+    # values like 39.12345 and those pick the grid square in assign_refs
+    codes, uniques = pd.factorize(values)
+    return np.array([round(value, decimals) for value in uniques.tolist()])[codes]
+
 def label():
-    df = common.get_historic_raw()
+    df = label_detections(common.get_historic_raw())
+    common.write_dataset(df, '{}/labelled_1Mile'.format(folder))
+
+
+def label_detections(df, first_date=None):
+    # Grid squares and date ids of raw FIRMS detections.  Date ids count the
+    # days from first_date, by default the first detection, as date id 1.
     df = df[(df['latitude'] >= common.S) & (df['latitude'] <= common.N) & (df['longitude'] >= common.W) & (
             df['longitude'] <= common.E)]
-    df['datetime'] = df.apply(lambda x: common.convert_to_datetime(x.acq_date, x.acq_time), axis=1)
+    df['datetime'] = parse_acq_datetimes(df['acq_date'], df['acq_time'])
     df = df[['latitude', 'longitude', 'datetime']]
-    df = df.drop_duplicates(subset=['latitude', 'longitude', 'datetime'])
-    df['date'] = df['datetime'].apply(lambda x: x.strftime('%Y-%m-%d'))
 
-    df['latitude_rounded'] = df.latitude.apply(lambda x: round(x, 4))
-    df['longitude_rounded'] = df.longitude.apply(lambda x: round(x, 4))
+    # Duplicate detections share one (latitude, longitude, minute) key
+    minutes = (df['datetime'] - df['datetime'].min()) // pd.Timedelta(minutes=1)
+    try:
+        keys = common.pack_keys([pd.factorize(df['latitude'])[0], pd.factorize(df['longitude'])[0], minutes])
+        df = df[~pd.Series(keys).duplicated().to_numpy()]
+    except ValueError:
+        # Too many distinct coordinates and minutes for one int64 key
+        df = df[~df.duplicated(subset=['latitude', 'longitude', 'datetime']).to_numpy()]
 
-    lat_refs = np.arange(common.S, common.N, step)[:-1] + step / 2
-    long_refs = np.arange(common.W, common.E, step)[:-1] + step / 2
+    day_codes, days = pd.factorize(df['datetime'].dt.normalize())
+    df['date'] = np.asarray(days.strftime('%Y-%m-%d'))[day_codes]
 
-    lat_refs = dict(zip(range(1, len(lat_refs) + 1), lat_refs))
-    long_refs = dict(zip(range(1, len(long_refs) + 1), long_refs))
+    df['latitude_rounded'] = round_values(df['latitude'], 4)
+    df['longitude_rounded'] = round_values(df['longitude'], 4)
 
-    min_date = df.date.min()
-    max_date = pd.to_datetime(df.date.max()) + datetime.timedelta(days=365 * 10)
-    dates = [d.strftime('%Y-%m-%d') for d in pd.date_range(min_date, max_date)]
-    date_ids = dict(zip(range(1, len(dates) + 1), dates))
+    lat_refs, long_refs = get_grid_refs()
 
-    df['lat_ref'] = np.nan
-    df['long_ref'] = np.nan
-    df['lat_ref_id'] = np.nan
-    df['long_ref_id'] = np.nan
+    df = assign_refs(df, lat_refs, long_refs)
 
-    lats_rounded = list(df['latitude_rounded'].unique())
-    longs_rounded = list(df['longitude_rounded'].unique())
+    first_date = days.min() if first_date is None else pd.Timestamp(first_date)
+    df['date_id'] = (days[day_codes] - first_date).days + 1
 
-    lats_rounded.sort()
-    longs_rounded.sort()
-
-    df = get_refs(df, step, lats_rounded, lat_refs, 'latitude_rounded', 'lat_ref', 'lat_ref_id', .00005)
-    df = get_refs(df, step, longs_rounded, long_refs, 'longitude_rounded', 'long_ref', 'long_ref_id', .00005)
+    return df
 
-    lats_remaining = list(df[df['lat_ref'].isna()].latitude.unique())
-    longs_remaining = list(df[df['long_ref'].isna()].longitude.unique())
 
-    lats_remaining.sort()
-    longs_remaining.sort()
+def expand_neighbors(df, offsets):
+    # (lat_ref_id, long_ref_id, date_id) of every row shifted by every offset
+    # of an (offsets, 2 or 3) array, offset by offset
+    lat_ref_ids = df['lat_ref_id'].to_numpy(dtype=np.float64)
+    long_ref_ids = df['long_ref_id'].to_numpy(dtype=np.float64)
+    date_ids = df['date_id'].to_numpy()
+    if offsets.shape[1] > 2:
+        new_date_ids = (date_ids + offsets[:, 2, None]).astype(date_ids.dtype).ravel()
+    else:
+        new_date_ids = np.tile(date_ids, len(offsets))
 
-    df = get_refs(df, step, lats_remaining, lat_refs, 'latitude', 'lat_ref', 'lat_ref_id', 0)
-    df = get_refs(df, step, longs_remaining, long_refs, 'longitude', 'long_ref', 'long_ref_id', 0)
+    return pd.DataFrame({
+        'lat_ref_id': (lat_ref_ids + offsets[:, 0, None]).ravel(),
+        'long_ref_id': (long_ref_ids + offsets[:, 1, None]).ravel(),
+        'date_id': new_date_ids,
+    })
 
-    df['date_id'] = df['date'].map({value: key for (key, value) in date_ids.items()})
 
-    df.to_csv('{}/labelled_1Mile.csv'.format(folder))
+def get_point_keys(df):
+    # One packed integer per (lat_ref_id, long_ref_id, date_id) of the frame
+    columns = [df[col].to_numpy().astype(np.int64) for col in ['lat_ref_id', 'long_ref_id', 'date_id']]
+    return common.pack_keys([column - column.min() for column in columns])
 
 
 def prepare_modeling_points(df, thresh):
-    modeling_coords = common.get_neighbor_coords(thresh)
+    offsets = common.get_neighbor_offsets(thresh)
 
-    start = datetime.datetime.now(pytz.timezone('US/Pacific'))
-    for col in modeling_coords:
-        print(col, modeling_coords.index(col) + 1, len(modeling_coords),
-              start + (datetime.datetime.now(pytz.timezone('US/Pacific')) - start) * len(modeling_coords) / (
-                          modeling_coords.index(col) + 1))
-        lat_shift = eval(col)[0]
-        long_shift = eval(col)[1]
-        df[col] = df.apply(lambda x: (x['lat_ref_id'] + lat_shift, x['long_ref_id'] + long_shift), axis=1)
-
-    melt = pd.melt(df, id_vars=['date_id', 'lat_ref_id', 'long_ref_id'], value_vars=modeling_coords)
-    melt['new_lat_ref_id'] = melt['value'].apply(lambda x: x[0])
-    melt['new_long_ref_id'] = melt['value'].apply(lambda x: x[1])
-    df_new = melt[['new_lat_ref_id', 'new_long_ref_id', 'date_id']].drop_duplicates(
-        subset=['new_lat_ref_id', 'new_long_ref_id', 'date_id'])
-    df_new = df_new.rename(columns={'new_lat_ref_id': 'lat_ref_id',
-                                    'new_long_ref_id': 'long_ref_id'})
+    df = df[['lat_ref_id', 'long_ref_id', 'date_id', 'num_points', 'fire']]
+    df_new = expand_neighbors(df, offsets)
     df_new['num_points'] = 0
     df_new['fire'] = 'W'
 
-    df = df[['lat_ref_id', 'long_ref_id', 'date_id', 'num_points', 'fire']]
+    # Points with detections come first and are kept over their neighbors
     df = df.append(df_new)
-    df = df.drop_duplicates(subset=['lat_ref_id', 'long_ref_id', 'date_id'])
+    df = df[~pd.Series(get_point_keys(df)).duplicated().to_numpy()]
 
     return df
 
 
-def prepare_weather_predictors(df):
+def build_weather_cube(weather, path):
+    # Writes the weather metrics to an on-disk (date, point, metric) array,
+    # NaN where a point has no weather on a date, and returns it mapped
+    # read-only.  Points are the grid squares with any weather; `points`
+    # maps (lat_ref_id, long_ref_id) to their position, or -1.
+    weather_metrics = common.WEATHER_METRICS
+    os.makedirs(path, exist_ok=True)
+
+    lat_ref_ids = weather['lat_ref_id'].to_numpy()
+    long_ref_ids = weather['long_ref_id'].to_numpy()
+    date_ids = weather['date_id'].to_numpy()
+    meta = {
+        'lat_ref_id': int(lat_ref_ids.min()),
+        'long_ref_id': int(long_ref_ids.min()),
+        'date_id': int(date_ids.min()),
+    }
+
+    cells = (lat_ref_ids - meta['lat_ref_id']) * (long_ref_ids.max() - meta['long_ref_id'] + 1) + (
+            long_ref_ids - meta['long_ref_id'])
+    point_cells, point_index = np.unique(cells, return_inverse=True)
+    points = np.full((lat_ref_ids.max() - meta['lat_ref_id'] + 1, long_ref_ids.max() - meta['long_ref_id'] + 1),
+                     -1, dtype=np.int32)
+    points.ravel()[point_cells] = np.arange(len(point_cells))
+    np.save(os.path.join(path, 'points.npy'), points)
+
+    values = np.lib.format.open_memmap(
+        os.path.join(path, 'values.npy'), mode='w+', dtype=np.float64,
+        shape=(date_ids.max() - meta['date_id'] + 1, len(point_cells), len(weather_metrics)),
+    )
+    values[:] = np.nan
+    values[date_ids - meta['date_id'], point_index] = weather[weather_metrics].to_numpy(dtype=np.float64)
+    values.flush()
+    del values
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    return load_weather_cube(path)
+
+
+def load_weather_cube(path):
+    with open(os.path.join(path, 'meta.json')) as f:
+        cube = json.load(f)
+    cube['points'] = np.load(os.path.join(path, 'points.npy'))
+    cube['values'] = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+    return cube
+
+
+def gather_weather(cube, lat_ref_ids, long_ref_ids, date_ids):
+    # Metrics at each (lat_ref_id, long_ref_id, date_id), NaN where the cube
+    # has none
+    lats = np.asarray(lat_ref_ids).astype(np.int64) - cube['lat_ref_id']
+    longs = np.asarray(long_ref_ids).astype(np.int64) - cube['long_ref_id']
+    dates = np.asarray(date_ids).astype(np.int64) - cube['date_id']
+    points, values = cube['points'], cube['values']
+
+    inside = ((lats >= 0) & (lats < points.shape[0]) & (longs >= 0) & (longs < points.shape[1])
+              & (dates >= 0) & (dates < values.shape[0]))
+    point = np.full(len(lats), -1, dtype=np.int64)
+    point[inside] = points[lats[inside], longs[inside]]
+    found = point >= 0
+
+    result = np.full((len(lats), values.shape[2]), np.nan)
+    result[found] = values[dates[found], point[found]]
+    return result
+
+
+def prepare_weather_predictors(df, cube_path=WEATHER_CUBE_DIR, rebuild=True):
+    # With rebuild=False an existing weather cube is used as it is
+    if rebuild or not os.path.exists(os.path.join(cube_path, 'meta.json')):
+        cube = get_weather_cube(cube_path)
+    else:
+        cube = load_weather_cube(cube_path)
+
+    # One gather per offset, in the column order of the former merges
+    print("gathering weather")
+    columns = {}
+    for offset, col in zip(common.get_weather_offsets(), common.get_weather_coords()):
+        values = gather_weather(cube, df['lat_ref_id'].to_numpy() + offset[0],
+                                df['long_ref_id'].to_numpy() + offset[1], df['date_id'].to_numpy() + offset[2])
+        for i, metric in enumerate(common.WEATHER_METRICS):
+            columns['{}{}'.format(metric, col)] = values[:, i]
+
+    df = df.reset_index(drop=True)
+    return pd.concat([df, pd.DataFrame(columns)], axis=1)
+
+
+def get_weather_cube(cube_path):
     print("getting weather")
     weather = common.get_weather_raw()
 
@@ -129,42 +272,72 @@ def prepare_weather_predictors(df):
     weather_metrics = common.WEATHER_METRICS
 
     print("getting lats")
-    weather['lat_ref_id'] = weather.Lat.apply(lambda x: round(x, 3)).map(lat_refs_reverse).astype(int)
+    weather['lat_ref_id'] = pd.Series(round_values(weather.Lat, 3)).map(lat_refs_reverse).astype(int).to_numpy()
     print("getting longs")
-    weather['long_ref_id'] = weather.Long.apply(lambda x: round(x, 3)).map(long_refs_reverse).astype(int)
+    weather['long_ref_id'] = pd.Series(round_values(weather.Long, 3)).map(long_refs_reverse).astype(int).to_numpy()
     print("get dates")
     weather['date_id'] = weather.Date.map(date_ids_reverse).astype(int)
 
-    weather_coords = common.get_weather_coords()
-    start = datetime.datetime.now(pytz.timezone('US/Pacific'))
-    for col in weather_coords:
-        print(col, weather_coords.index(col) + 1, len(weather_coords),
-              start + (datetime.datetime.now(pytz.timezone('US/Pacific')) - start) * len(weather_coords) / (
-                          weather_coords.index(col) + 1))
-        lat_shift = eval(col)[0]
-        long_shift = eval(col)[1]
-        date_shift = eval(col)[2]
-        df[col] = df.apply(
-            lambda x: (x['lat_ref_id'] + lat_shift, x['long_ref_id'] + long_shift, x['date_id'] + date_shift), axis=1)
-        df['new_lat_ref_id{}'.format(col)] = df[col].apply(lambda x: x[0])
-        df['new_long_ref_id{}'.format(col)] = df[col].apply(lambda x: x[1])
-        df['new_date_id{}'.format(col)] = df[col].apply(lambda x: x[2])
-        df = df.merge(weather[['date_id', 'lat_ref_id', 'long_ref_id'] + weather_metrics].rename(
-            columns={'date_id': 'date_id_weather',
-                     'lat_ref_id': 'lat_ref_id_weather',
-                     'long_ref_id': 'long_ref_id_weather'}),
-            left_on=['new_date_id{}'.format(col), 'new_lat_ref_id{}'.format(col),
-                     'new_long_ref_id{}'.format(col)],
-            right_on=['date_id_weather', 'lat_ref_id_weather', 'long_ref_id_weather'], how='left')
-        df = df.rename(columns=lambda metric: '{}{}'.format(metric, col) if metric in weather_metrics else metric)
-        df = df.drop(
-            columns=[col, 'new_date_id{}'.format(col), 'new_lat_ref_id{}'.format(col), 'new_long_ref_id{}'.format(col),
-                     'date_id_weather', 'lat_ref_id_weather', 'long_ref_id_weather'])
+    # A point and date in more than one weather file keeps its first row
+    weather = weather.drop_duplicates(subset=['date_id', 'lat_ref_id', 'long_ref_id'])
+
+    print("building weather cube")
+    return build_weather_cube(weather, cube_path)
+
+
+# Grid squares and dates packed into one sortable integer; ids are offset by
+# CELL_ID_OFFSET so that neighbors beyond the extended grid stay positive
+CELL_ID_OFFSET = 2**9
+
+def pack_cells(date_ids, lat_ref_ids, long_ref_ids):
+    date_ids = np.asarray(date_ids).astype(np.int64)
+    lat_ref_ids = np.asarray(lat_ref_ids).astype(np.int64) + CELL_ID_OFFSET
+    long_ref_ids = np.asarray(long_ref_ids).astype(np.int64) + CELL_ID_OFFSET
+    return (date_ids << 20) | (lat_ref_ids << 10) | long_ref_ids
+
+
+def get_fire_raster(df_fire):
+    # Sparse (date, lat, long) raster of the detection counts: the packed
+    # cells holding detections, sorted, and their counts
+    keys = pack_cells(df_fire['date_id'], df_fire['lat_ref_id'], df_fire['long_ref_id'])
+    order = np.argsort(keys, kind='mergesort')
+    return keys[order], df_fire['num_points'].to_numpy()[order]
 
-    return df
 
+def gather_fire(raster, date_ids, lat_ref_ids, long_ref_ids):
+    # Detection counts at each cell and whether the cell has any
+    keys, counts = raster
+    query = pack_cells(date_ids, lat_ref_ids, long_ref_ids)
+    if not len(keys):
+        return np.zeros(len(query), dtype=counts.dtype), np.zeros(len(query), dtype=bool)
+    i = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+    found = keys[i] == query
+    return np.where(found, counts[i], 0), found
 
-def prepare_nasa_predictors(df, df_fire):
+
+def prepare_nasa_predictors(df, df_fire, engine='raster'):
+    # engine='merge' joins df_fire once per offset, 'raster' gathers every
+    # offset from get_fire_raster; both give the same frame
+    if engine == 'merge':
+        return prepare_nasa_predictors_merge(df, df_fire)
+    if engine != 'raster':
+        raise ValueError('Unknown engine {}'.format(engine))
+
+    raster = get_fire_raster(df_fire)
+    lat_ref_ids = df['lat_ref_id'].to_numpy()
+    long_ref_ids = df['long_ref_id'].to_numpy()
+    date_ids = df['date_id'].to_numpy()
+
+    columns = {}
+    for offset, col in zip(common.get_neighbor_offsets(3, 2), common.get_neighbor_coords(3, 2)):
+        counts = gather_fire(raster, date_ids + offset[2], lat_ref_ids + offset[0], long_ref_ids + offset[1])[0]
+        columns['num_points{}'.format(col)] = counts.astype(np.float64)
+
+    df = df.reset_index(drop=True)
+    return pd.concat([df, pd.DataFrame(columns)], axis=1)
+
+
+def prepare_nasa_predictors_merge(df, df_fire):
     nasa_coords = common.get_neighbor_coords(3, 2)
 
     start = datetime.datetime.now(pytz.timezone('US/Pacific'))
@@ -197,7 +370,21 @@ def prepare_nasa_predictors(df, df_fire):
     return df
 
 
-def prepare_target(df, df_fire):
+def prepare_target(df, df_fire, engine='raster'):
+    if engine == 'merge':
+        return prepare_target_merge(df, df_fire)
+    if engine != 'raster':
+        raise ValueError('Unknown engine {}'.format(engine))
+
+    df = df.reset_index(drop=True)
+    df['target_date'] = df['date_id'].to_numpy().astype(np.int64) + 1
+    found = gather_fire(get_fire_raster(df_fire), df['target_date'], df['lat_ref_id'], df['long_ref_id'])[1]
+    df['Target'] = found.astype(np.int64)
+
+    return df
+
+
+def prepare_target_merge(df, df_fire):
     df['target_date'] = df['date_id'].apply(lambda x: x + 1)
     df = df.merge(
         df_fire[['date_id', 'lat_ref_id', 'long_ref_id', 'num_points']].rename(columns={'date_id': 'date_id_fire',
@@ -213,17 +400,28 @@ def prepare_target(df, df_fire):
     return df
 
 
-def prepare_for_modeling():
-
-    df = pd.read_csv('{}/labelled_1Mile.csv'.format(folder))
-    df = common.reduce_mem_usage(df)
-
+def get_fire_counts(df):
+    # Detections per grid square and date of labelled detections
     df = df[['lat_ref_id', 'long_ref_id', 'date_id']]
     df['num_points'] = 1
 
-    df = df.groupby(by=['lat_ref_id', 'long_ref_id', 'date_id']).count().reset_index()
+    return df.groupby(by=['lat_ref_id', 'long_ref_id', 'date_id']).count().reset_index()
+
+
+def add_month_dummies(df):
+    # Indicator columns month_1 to month_12, whichever months the frame holds
+    dates = df['date_id'].astype(int).astype(str).map(date_ids)
+    months = pd.to_datetime(dates, format='%Y-%m-%d').dt.month.to_numpy()
+    for month in range(1, 13):
+        df['month_{}'.format(month)] = (months == month).astype('int64')
+
+    return df
+
+
+def prepare_points(df):
+    # Modeling points of the detection counts: squares with detections
+    # (thresh 0) and their neighbors within 1 and 2 squares
     df['fire'] = 'R'
-    df_fire = df.copy()
 
     df1 = prepare_modeling_points(df, 1)
     df0 = df1[df1.num_points > 0]
@@ -242,17 +440,118 @@ def prepare_for_modeling():
 
     df = df.drop_duplicates(subset=[col for col in df.columns if col != 'thresh'])
 
+    return df
+
+
+def prepare_features(df, df_fire, rebuild_weather=True):
     df = common.reduce_mem_usage(df)
-    df = prepare_weather_predictors(df)
+    df = prepare_weather_predictors(df, rebuild=rebuild_weather)
 
     df = prepare_nasa_predictors(df, df_fire)
 
-    df['month'] = df['date_id'].apply(lambda x: str(int(x))).map(date_ids).apply(lambda x: pd.to_datetime(x).month)
-    df = pd.get_dummies(df, columns=['month'], dtype='int64')
+    df = add_month_dummies(df)
 
     df = prepare_target(df, df_fire)
 
-    df.to_csv('{}/modeling_df.csv'.format(folder))
+    return df
+
+
+def read_labelled_counts(first_date_id=None, last_date_id=None):
+    # get_fire_counts of the labelled detections from first_date_id to last_date_id
+    df = common.read_dataset('{}/labelled_1Mile'.format(folder), columns=['lat_ref_id', 'long_ref_id', 'date_id'],
+                             first_date_id=first_date_id, last_date_id=last_date_id)
+
+    return get_fire_counts(common.reduce_mem_usage(df))
+
+
+def get_date_chunks(df_fire, memory_budget_mb, workers=1):
+    # Consecutive date ranges whose modeling rows fit the budget, at least one
+    # per worker.  A square with detections gives at most one row per
+    # neighbor within 2 squares.
+    dates = df_fire.groupby('date_id').size()
+    if dates.empty:
+        return []
+
+    budget_cells = math.ceil(dates.sum() / workers)
+    if memory_budget_mb is not None:
+        columns = (len(common.get_weather_coords()) * len(common.WEATHER_METRICS)
+                   + len(common.get_neighbor_coords(3, 2)) + 12 + 8)
+        row_bytes = columns * 8 * FEATURE_COPIES * len(common.get_neighbor_offsets(2))
+        budget_cells = min(budget_cells, memory_budget_mb * 1024**2 // row_bytes)
+
+    chunks = []
+    first = None
+    cells = 0
+    for date_id, date_cells in dates.items():
+        if first is not None and cells + date_cells > budget_cells:
+            chunks.append((first, last))
+            first = None
+        if first is None:
+            first = date_id
+            cells = 0
+        cells += date_cells
+        last = date_id
+    chunks.append((first, last))
+
+    return chunks
+
+
+def prepare_chunk(df_fire, first, last):
+    # Modeling rows of the dates first to last, by date so that their order
+    # does not depend on how the dates are split.  Their features read
+    # df_fire from LOOK_BACK_DAYS before first to the day after last.
+    print('dates', date_ids[str(int(first))], date_ids[str(int(last))])
+    df = prepare_points(df_fire[(df_fire.date_id >= first) & (df_fire.date_id <= last)].copy())
+    df = prepare_features(df, df_fire, rebuild_weather=False)
+
+    return df.sort_values('date_id', kind='mergesort').reset_index(drop=True)
+
+
+def map_in_order(func, args, workers):
+    # func(*a) of each of args, in order, from a pool of processes holding at
+    # most `workers` results at a time
+    if workers == 1:
+        for a in args:
+            yield func(*a)
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        pending = collections.deque()
+        for a in args:
+            pending.append(pool.apply_async(func, a))
+            if len(pending) == workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def prepare_for_modeling(memory_budget_mb=MEMORY_BUDGET_MB, workers=WORKERS):
+
+    df_fire = read_labelled_counts()
+
+    if memory_budget_mb is not None:
+        memory_budget_mb /= workers
+    chunks = get_date_chunks(df_fire, memory_budget_mb, workers)
+
+    path = '{}/modeling_df'.format(folder)
+    common.remove_dataset(path)
+    if not chunks:
+        print('No detections to model')
+        return
+
+    get_weather_cube(WEATHER_CUBE_DIR)
+
+    # Ranges of dates are built by the workers, each sent the detection counts
+    # its features read, and written in date order as they finish
+    args = ((df_fire[(df_fire.date_id >= first - LOOK_BACK_DAYS) & (df_fire.date_id <= last + 1)], first, last)
+            for first, last in chunks)
+
+    rows = 0
+    for df in map_in_order(prepare_chunk, args, workers):
+        df.index += rows
+        common.write_dataset(df, path, append=True)
+        rows += len(df)
+        del df
 
 
 if __name__ == '__main__':
@@ -4,9 +4,12 @@ import re
 import numpy as np
 import pickle
 import gcsfs
+import gzip
 import json
 import multiprocessing
+import os
 import shap
+import tempfile
 
 from identify_wildfires import identify_wildfires
 import common
@@ -22,8 +25,128 @@ county_df = pd.read_csv('{}/counties/ALL_county_coords.csv'.format(common.GCS_PR
 dates = pd.date_range('2021-01-01','2022-02-01')
 dates = [d.strftime('%Y-%m-%d') for d in dates]
 
+cols_to_exclude = ['date_id', 'Target', 'lat_ref_id', 'long_ref_id', 'Pred', 'shap_dict_key', 'latitude',
+                   'longitude', 'date', 'model']
+
+# Read by ShapStore in dash-app/shap_store.py; tests/test_display.py checks
+# that a store written here reads back through it.
+SHAP_INDEX_DTYPE = np.dtype([
+    ('key', '<i8'), ('start', '<i8'), ('stop', '<i8'), ('base_value', '<f8'),
+])
+SHAP_ENTRY_DTYPE = np.dtype([
+    ('feature', '<i2'), ('effect', '<f4'), ('value', '<f4'),
+])
+
+
+def shap_key_code(key):
+
+    date, lat, lon = key.split('_')
+    day = int(np.datetime64(date, 'D').astype(np.int64))
+    lat = int(round(float(lat) * 1000)) + 2**19
+    lon = int(round(float(lon) * 1000)) + 2**19
+
+    return (day << 40) | (lat << 20) | lon
+
+
+def write_shap_entries(shap_dicts, f, offset=0):
+
+    index = []
+    for shap_dict_date in shap_dicts:
+        for key, shap_dict in shap_dict_date.items():
+            features = shap_dict['features']
+            entries = np.empty(len(features), dtype=SHAP_ENTRY_DTYPE)
+            entries['feature'] = [int(i) for i in features]
+            entries['effect'] = [features[i]['effect'] for i in features]
+            entries['value'] = [features[i]['value'] for i in features]
+            entries.tofile(f)
+
+            index.append((shap_key_code(key), offset, offset + len(entries), shap_dict['baseValue']))
+            offset += len(entries)
+        print('wrote', len(index), 'keys')
+
+    return np.array(index, dtype=SHAP_INDEX_DTYPE)
+
+
+def write_shap_store(shap_dicts, feature_names, path):
+
+    if 'gs://' in path:
+        with tempfile.TemporaryDirectory() as local_path:
+            write_shap_store(shap_dicts, feature_names, local_path)
+            fs = gcsfs.GCSFileSystem()
+            for name in ['entries.bin', 'index.npy', 'feature_names.json']:
+                fs.put(os.path.join(local_path, name), '{}/{}'.format(path, name))
+        return
+
+    os.makedirs(path, exist_ok=True)
+
+    with open(os.path.join(path, 'entries.bin'), 'wb') as f:
+        index = write_shap_entries(shap_dicts, f)
+
+    index.sort(order='key')
+    np.save(os.path.join(path, 'index.npy'), index)
+
+    with open(os.path.join(path, 'feature_names.json'), 'w') as f:
+        json.dump(list(feature_names), f)
+
+
+def append_shap_store(shap_dicts, path):
+
+    # Adds keys to an existing store: their entries go after the present ones
+    # and the index is merged and rewritten, pointing keys already in the
+    # store to their new entries.
+    if 'gs://' in path:
+        fs = gcsfs.GCSFileSystem()
+        with tempfile.TemporaryDirectory() as local_path:
+            fs.get('{}/index.npy'.format(path), os.path.join(local_path, 'index.npy'))
+            offset = fs.size('{}/entries.bin'.format(path)) // SHAP_ENTRY_DTYPE.itemsize
+            index = append_shap_entries(shap_dicts, local_path, offset)
+            fs.put(os.path.join(local_path, 'entries.bin'), '{}/entries.bin.part'.format(path))
+            fs.merge('{}/entries.bin'.format(path), ['{}/entries.bin'.format(path), '{}/entries.bin.part'.format(path)])
+            fs.rm('{}/entries.bin.part'.format(path))
+            fs.put(os.path.join(local_path, 'index.npy'), '{}/index.npy'.format(path))
+        return index
+
+    offset = os.path.getsize(os.path.join(path, 'entries.bin')) // SHAP_ENTRY_DTYPE.itemsize
+    return append_shap_entries(shap_dicts, path, offset)
+
+
+def append_shap_entries(shap_dicts, path, offset):
+
+    with open(os.path.join(path, 'entries.bin'), 'ab') as f:
+        new_index = write_shap_entries(shap_dicts, f, offset)
+
+    # Keys written again replace their earlier entries
+    index = np.load(os.path.join(path, 'index.npy'))
+    index = np.concatenate([index[~np.isin(index['key'], new_index['key'])], new_index])
+    index.sort(order='key')
+    np.save(os.path.join(path, 'index.npy'), index)
+
+    return index
+
+
+def convert_shap_dicts(src, dest, feature_names_file):
+
+    # Build a SHAP store from the per-day shap_dict_<date>.json.gz files
+    def read_shap_dicts():
+        for file in sorted(os.listdir(src)):
+            if file.startswith('shap_dict_') and file.endswith('.json.gz'):
+                with gzip.open(os.path.join(src, file)) as f:
+                    yield json.load(f)
+
+    with open(feature_names_file) as f:
+        feature_names = f.read().splitlines()
+
+    write_shap_store(read_shap_dicts(), feature_names, dest)
+
+
 def create_shap_dict(X_test):
 
+    feature_names = [col for col in X_test.columns if col not in cols_to_exclude]
+    write_shap_store(get_shap_dicts(X_test), feature_names, '{}/shap_store'.format(folder))
+
+
+def get_shap_dicts(X_test, dates=dates):
+
     for date in dates:
         print(date)
 
@@ -67,8 +190,6 @@ def create_shap_dict(X_test):
         X_test = X_test.sort_values(by='date_id')
         X_test = X_test.reset_index(drop=True)
 
-        cols_to_exclude = ['date_id', 'Target', 'lat_ref_id', 'long_ref_id', 'Pred', 'shap_dict_key', 'latitude',
-                           'longitude', 'date', 'model']
         df = X_test[[col for col in X_test.columns if col not in cols_to_exclude]]
 
         filename1 = '{}/model_thresh1.sav'.format(folder)
@@ -110,37 +231,43 @@ def create_shap_dict(X_test):
             p.join()
         print('joined')
 
-        if 'gs://' in common.GCS_PREFIX:
-            fs = gcsfs.GCSFileSystem()
-            with fs.open("{}/shap/shap_dict_{}.json".format(folder, date), "w") as outfile:
-                json.dump(shap_dict_date.copy(), outfile)
-        else:
-            with open("{}/shap/shap_dict_{}.json".format(folder, date), "w") as outfile:
-                json.dump(shap_dict_date.copy(), outfile)
-        print('wrote')
+        yield shap_dict_date.copy()
 
 
 def create_display_frame(X_test):
 
-    df_pred = X_test[['latitude', 'longitude', 'date', 'Target', 'Pred']]
+    df_historic = common.read_dataset('{}/labelled_1Mile'.format(folder), columns=['latitude', 'longitude', 'date', 'date_id'])
+
+    df_display = get_display_frame(df_historic, X_test)
+    del(df_historic)
+
+    common.write_dataset(df_display, '{}/historic_and_predictions'.format(common.folder))
+
+    df_pred = X_test[['latitude', 'longitude', 'date']]
+
+    return df_pred
+
+
+def export_display_frame(path):
+    # The application reads the display frame from a CSV file, by default
+    # modeling-2_historic_and_predictions.csv.gz
+    common.read_dataset('{}/historic_and_predictions'.format(folder)).to_csv(path)
+
+
+def get_display_frame(df_historic, X_test):
+
+    df_pred = X_test[['latitude', 'longitude', 'date', 'date_id', 'Target', 'Pred']]
 
     df_pred['type'] = 'Prediction'
 
-    df_historic = pd.read_csv('{}/labelled_1Mile.csv'.format(folder), index_col=0)
-    df_historic = df_historic[['latitude', 'longitude', 'date']]
+    df_historic = df_historic[['latitude', 'longitude', 'date', 'date_id']]
     df_historic['type'] = 'Historic'
     df_historic['Target'] = np.nan
     df_historic['Pred'] = np.nan
 
     df_display = df_historic.append(df_pred)
-    del(df_historic)
-
-    df_display = df_display[['latitude', 'longitude', 'date', 'type', 'Target', 'Pred']]
-    df_display.to_csv('{}/historic_and_predictions.csv'.format(common.folder))
 
-    df_pred = df_pred[['latitude', 'longitude', 'date']]
-
-    return df_pred
+    return df_display[['latitude', 'longitude', 'date', 'date_id', 'type', 'Target', 'Pred']]
 
 
 def get_county(lat_min, lat_max, long_min, long_max):
@@ -161,6 +288,27 @@ def get_county(lat_min, lat_max, long_min, long_max):
 
 def create_id_frame(df):
 
+    df_display = get_id_frame(df)
+
+    df_display.to_csv('{}/fire_ids.csv'.format(common.folder))
+    common.remove_dataset('{}/fire_ids'.format(common.folder))
+
+
+def read_fire_ids(exclude=None):
+    # fire_ids.csv and the fire ids update.py wrote for each daily file to
+    # fire_ids/, but for the file `exclude`
+    paths = ['{}/fire_ids.csv'.format(folder)] + common.list_files('{}/fire_ids/*.csv'.format(folder))
+    return pd.concat([pd.read_csv(path, index_col=0) for path in paths if path != exclude])
+
+
+def export_fire_ids(path):
+    # The application reads the fire ids from a CSV file, by default
+    # modeling-2_fire_ids.csv.gz
+    read_fire_ids().to_csv(path)
+
+
+def get_id_frame(df):
+
     df = identify_wildfires(df)
 
     display_cols = ['wildfire_id', 'date', 'lat_min', 'lat_max', 'long_min', 'long_max', 'county']
@@ -184,15 +332,15 @@ def create_id_frame(df):
 
             df_display = df_display.append(df_new)
 
-    df_display.to_csv('{}/fire_ids.csv'.format(common.folder))
+    return df_display
 
 
 if __name__=='__main__':
 
-    X_test_0or1 = pd.read_csv('{}/X_test_thresh{}.csv'.format(folder, 1), index_col =0)
+    X_test_0or1 = common.read_dataset('{}/X_test_thresh{}'.format(folder, 1))
     X_test_0or1['model'] = 1
 
-    X_test_2 = pd.read_csv('{}/X_test_thresh{}.csv'.format(folder, 2), index_col =0)
+    X_test_2 = common.read_dataset('{}/X_test_thresh{}'.format(folder, 2))
     X_test_2['model'] = 2
 
     X_test = X_test_0or1.append(X_test_2)
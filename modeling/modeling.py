@@ -1,4 +1,3 @@
-import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
 import math
@@ -17,6 +16,8 @@ lat_refs, long_refs, date_ids = common.get_ref_dictionaries()
 
 date_id_start = 2558
 
+cols_to_exclude = ['date_id', 'Target', 'lat_ref_id', 'long_ref_id']
+
 
 def feature_engineering(df, thresh):
     for i in range(0, 2):
@@ -108,8 +109,6 @@ def model(df, thresh):
     del (train)
     del (test)
 
-    cols_to_exclude = ['date_id', 'Target', 'lat_ref_id', 'long_ref_id']
-
     model = RandomForestClassifier(n_estimators=100, max_features=10, random_state=0, verbose=2, n_jobs=64)
     model.fit(X_train[[col for col in X_train.columns if col not in cols_to_exclude]], y_train)
     del (y_train)
@@ -123,6 +122,23 @@ def model(df, thresh):
         with open(filename, 'wb') as f:
             pickle.dump(model, f)
 
+    X_test = predict(model, X_test)
+
+    common.write_dataset(X_test, '{}/X_test_thresh{}'.format(folder, thresh))
+
+
+def load_model(thresh):
+    filename = '{}/model_thresh{}.sav'.format(folder, thresh)
+    if 'gs://' in common.GCS_PREFIX:
+        fs = gcsfs.GCSFileSystem()
+        with fs.open(filename, 'rb') as f:
+            return pickle.load(f)
+    else:
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+
+def predict(model, X_test):
     preds = list(model.predict_proba(X_test[[col for col in X_test.columns if col not in cols_to_exclude]])[::, 1])
 
     X_test['Pred'] = preds
@@ -132,13 +148,11 @@ def model(df, thresh):
     X_test['shap_dict_key'] = X_test.apply(
         lambda x: '{}_{}_{}'.format(x.date, round(x.latitude, 3), round(x.longitude, 3)), axis=1)
 
-    X_test.to_csv('{}/X_test_thresh{}.csv'.format(folder, thresh))
+    return X_test
 
 
 if __name__ == '__main__':
-    file = '{}/modeling_df.csv'.format(folder)
-    df = pd.read_csv(file, index_col=0)
-    df = df[df.date_id < 2955].dropna()
+    df = common.read_dataset('{}/modeling_df'.format(folder), last_date_id=2954).dropna()
 
     df0or1 = df[df.thresh < 2].drop(columns=['thresh'])
     df2 = df[df.thresh == 2].drop(columns=['thresh'])
@@ -0,0 +1,14 @@
+import os
+import sys
+
+MODELING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, MODELING_DIR)
+
+import common
+
+# The tests read the grid and date refs from the repository's data directory
+common.GCS_PREFIX = os.path.join(MODELING_DIR, 'data')
+common.folder = '{}/modeling-2'.format(common.GCS_PREFIX)
+
+# The application's reader of the SHAP store written by display
+sys.path.append(os.path.join(MODELING_DIR, os.pardir, 'dash-app'))
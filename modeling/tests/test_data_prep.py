@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import common
+import data_prep
+
+step = common.square_side_degrees
+
+
+def get_refs(df, step, coords, coord_refs, coord_string, coord_ref_string, coord_ref_id_string, buffer):
+    # The per-coordinate assignment label() made before assign_refs
+    for coord in coords:
+        refs_to_check = {k: coord_refs[k] for k in coord_refs if
+                         (coord < coord_refs[k] + step) & (coord > coord_refs[k] - step)}
+        if refs_to_check:
+            for ID in refs_to_check:
+                coord_ref = refs_to_check[ID]
+                if abs(coord - coord_ref) < step/2:
+                    df.loc[df[coord_string] == coord, coord_ref_string] = coord_ref
+                    df.loc[df[coord_string] == coord, coord_ref_id_string] = ID
+                    break
+        else:
+            dist_to_min_coord_ref = abs(coord - coord_refs[min(coord_refs)])
+            dist_to_max_coord_ref = abs(coord - coord_refs[max(coord_refs)])
+            if dist_to_min_coord_ref < dist_to_max_coord_ref:
+                df.loc[df[coord_string] == coord, coord_ref_string] = coord_refs[min(coord_refs)]
+                df.loc[df[coord_string] == coord, coord_ref_id_string] = min(coord_refs)
+            else:
+                df.loc[df[coord_string] == coord, coord_ref_string] = coord_refs[max(coord_refs)]
+                df.loc[df[coord_string] == coord, coord_ref_id_string] = max(coord_refs)
+
+    return df
+
+
+def assign_refs_loop(df, lat_refs, long_refs):
+    df['lat_ref'] = np.nan
+    df['long_ref'] = np.nan
+    df['lat_ref_id'] = np.nan
+    df['long_ref_id'] = np.nan
+
+    lats_rounded = sorted(df['latitude_rounded'].unique())
+    longs_rounded = sorted(df['longitude_rounded'].unique())
+
+    df = get_refs(df, step, lats_rounded, lat_refs, 'latitude_rounded', 'lat_ref', 'lat_ref_id', .00005)
+    df = get_refs(df, step, longs_rounded, long_refs, 'longitude_rounded', 'long_ref', 'long_ref_id', .00005)
+
+    lats_remaining = sorted(df[df['lat_ref'].isna()].latitude.unique())
+    longs_remaining = sorted(df[df['long_ref'].isna()].longitude.unique())
+
+    df = get_refs(df, step, lats_remaining, lat_refs, 'latitude', 'lat_ref', 'lat_ref_id', 0)
+    df = get_refs(df, step, longs_remaining, long_refs, 'longitude', 'long_ref', 'long_ref_id', 0)
+
+    return df
+
+
+def random_detections(n, seed):
+    # Detections at 5 decimals with points on, between, half a square from
+    # and beyond the references mixed in
+    rng = np.random.default_rng(seed)
+    lat_refs, long_refs = data_prep.get_grid_refs()
+    columns = {}
+    for name, coord_refs, low, high in [('latitude', lat_refs, common.S, common.N),
+                                        ('longitude', long_refs, common.W, common.E)]:
+        refs = np.array(list(coord_refs.values()))
+        values = np.concatenate([
+            rng.uniform(low - 2 * step, high + 2 * step, n),
+            rng.choice(refs, n // 10),
+            rng.choice(refs[:-1] + np.diff(refs) / 2, n // 10),
+            rng.choice(refs, n // 10) + rng.choice([-1, 1], n // 10) * step / 2,
+        ])
+        columns[name] = np.round(rng.permutation(values)[:n], 5)
+    df = pd.DataFrame(columns)
+    df['latitude_rounded'] = df.latitude.apply(lambda x: round(x, 4))
+    df['longitude_rounded'] = df.longitude.apply(lambda x: round(x, 4))
+    return df
+
+
+@pytest.mark.parametrize('n, seed', [(5000, 0), (20000, 1)])
+def test_assign_refs_matches_loop(n, seed):
+    df = random_detections(n, seed)
+    lat_refs, long_refs = data_prep.get_grid_refs()
+
+    expected = assign_refs_loop(df.copy(), lat_refs, long_refs)
+    result = data_prep.assign_refs(df.copy(), lat_refs, long_refs)
+
+    for col in ['lat_ref', 'lat_ref_id', 'long_ref', 'long_ref_id']:
+        np.testing.assert_array_equal(result[col].to_numpy(), expected[col].to_numpy(), err_msg=col)
+
+
+def random_fire_counts(n, seed):
+    # Detection counts of squares around the middle of the grid
+    rng = np.random.default_rng(seed)
+    df_fire = pd.DataFrame({
+        'lat_ref_id': rng.integers(150, 170, n).astype(np.float64),
+        'long_ref_id': rng.integers(200, 220, n).astype(np.float64),
+        'date_id': rng.integers(2900, 2906, n),
+    })
+    df_fire['num_points'] = rng.integers(1, 30, n)
+    return df_fire.drop_duplicates(subset=['lat_ref_id', 'long_ref_id', 'date_id']).reset_index(drop=True)
+
+
+def test_raster_engine_matches_merge():
+    df_fire = random_fire_counts(300, 0)
+    df = data_prep.prepare_points(df_fire[df_fire.date_id.isin([2903, 2904])].copy())
+
+    for prepare in [data_prep.prepare_nasa_predictors, data_prep.prepare_target]:
+        expected = prepare(df.copy(), df_fire, engine='merge').reset_index(drop=True)
+        result = prepare(df.copy(), df_fire, engine='raster')
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_empty_raster_gathers_nothing():
+    df_fire = random_fire_counts(0, 0)
+    counts, found = data_prep.gather_fire(data_prep.get_fire_raster(df_fire), [2900, 2901], [160, 161], [210, 211])
+
+    np.testing.assert_array_equal(counts, [0, 0])
+    np.testing.assert_array_equal(found, [False, False])
+
+
+def test_date_chunks_fit_the_budget():
+    df_fire = random_fire_counts(300, 0)
+    cells = df_fire.groupby('date_id').size()
+
+    chunks = data_prep.get_date_chunks(df_fire, None, workers=3)
+    assert chunks[0][0] == cells.index.min() and chunks[-1][1] == cells.index.max()
+    assert all(last + 1 == first for (_, last), (first, _) in zip(chunks, chunks[1:]))
+    assert len(chunks) >= 3
+
+    assert len(data_prep.get_date_chunks(df_fire, 1)) == len(cells)
+
+
+def test_no_detections_give_an_empty_modeling_frame(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_prep, 'folder', str(tmp_path))
+    common.write_dataset(random_fire_counts(0, 0), '{}/labelled_1Mile'.format(tmp_path))
+
+    assert data_prep.get_date_chunks(data_prep.read_labelled_counts(), None) == []
+    data_prep.prepare_for_modeling(workers=2)
+
+    assert common.read_dataset('{}/modeling_df'.format(tmp_path)).empty
+
+
+def test_label_dedup_falls_back_when_keys_overflow(monkeypatch):
+    df = random_detections(2000, 2)[['latitude', 'longitude']]
+    rng = np.random.default_rng(2)
+    df['acq_date'] = rng.choice(['2021-07-01', '2021-07-02', '2021-07-03'], len(df))
+    df['acq_time'] = rng.choice(['0954', '1042', '2136'], len(df))
+    df = pd.concat([df, df.sample(500, random_state=0)], ignore_index=True)
+
+    expected = data_prep.label_detections(df)
+
+    def overflow(columns):
+        raise ValueError('Keys need 64 bits, more than fit in an int64')
+    monkeypatch.setattr(common, 'pack_keys', overflow)
+    result = data_prep.label_detections(df)
+
+    assert not expected.duplicated(subset=['latitude', 'longitude', 'datetime']).any()
+    pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,65 @@
+import numpy as np
+
+import display
+from shap_store import ShapStore
+
+
+def make_shap_dicts(dates, points_per_date, seed):
+    # {key: shap_dict} per date, keyed as modeling.predict names the points
+    rng = np.random.default_rng(seed)
+    shap_dicts = []
+    for date in dates:
+        shap_dict_date = {}
+        for _ in range(points_per_date):
+            lat = round(rng.uniform(37.25, 42.6), 3)
+            lon = round(rng.uniform(-124.5, -118.7), 3)
+            features = {
+                str(feature): {'effect': float(rng.normal()), 'value': round(float(rng.normal(50, 10)), 2)}
+                for feature in rng.choice(400, rng.integers(1, 20), replace=False).tolist()
+            }
+            shap_dict_date['{}_{}_{}'.format(date, lat, lon)] = {'baseValue': float(rng.random()), 'features': features}
+        shap_dicts.append(shap_dict_date)
+    return shap_dicts
+
+
+def assert_read_back(store, shap_dict_date):
+    for key, shap_dict in shap_dict_date.items():
+        result = store.get(key)
+        assert result['baseValue'] == shap_dict['baseValue']
+        assert list(result['features']) == list(shap_dict['features'])
+        for feature, entry in shap_dict['features'].items():
+            # Values are stored as float32 and read at their shortest repr
+            assert result['features'][feature]['value'] == entry['value']
+            assert result['features'][feature]['effect'] == float(np.float32(entry['effect']))
+
+
+def test_written_store_reads_back(tmp_path):
+    shap_dicts = make_shap_dicts(['2021-07-{:02d}'.format(day) for day in range(1, 9)], 300, 0)
+    display.write_shap_store(iter(shap_dicts), ['f{}'.format(i) for i in range(400)], str(tmp_path))
+    store = ShapStore(str(tmp_path))
+
+    assert store.feature_names[:2] == ['f0', 'f1']
+    for shap_dict_date in shap_dicts:
+        assert_read_back(store, shap_dict_date)
+    assert store.get('2021-06-30_38.5_-121.5') is None
+    assert store.get('2021-07-09_38.5_-121.5') is None
+
+
+def test_appended_keys_replace_existing_ones(tmp_path):
+    shap_dicts = make_shap_dicts(['2021-07-01', '2021-07-02'], 200, 0)
+    display.write_shap_store(iter(shap_dicts), ['f{}'.format(i) for i in range(400)], str(tmp_path))
+
+    # The second date written again with new values, and a new date
+    replaced = make_shap_dicts(['2021-07-02'], 200, 0)[0]
+    for shap_dict in replaced.values():
+        shap_dict['baseValue'] += 1
+        for entry in shap_dict['features'].values():
+            entry['effect'] = -entry['effect']
+    added = make_shap_dicts(['2021-07-03'], 200, 1)[0]
+    index = display.append_shap_store(iter([replaced, added]), str(tmp_path))
+    store = ShapStore(str(tmp_path))
+
+    assert len(np.unique(index['key'])) == len(index)
+    assert_read_back(store, shap_dicts[0])
+    assert_read_back(store, replaced)
+    assert_read_back(store, added)
@@ -0,0 +1,148 @@
+"""Incremental daily update of the modeling artifacts.
+
+After a full run of data_prep >> modeling >> display, record the daily FIRMS
+files it covered once:
+
+    python update.py --init
+
+Then, whenever new files have arrived in nasa-firms/suomi-npp-viirs-c2:
+
+    python update.py
+
+Only the new files are labelled and added to the labelled_1Mile dataset.
+Then, file by file, the modeling points and features are computed for the
+dates of the file alone, reading the look-back days from labelled_1Mile and
+the weather from the existing weather cube.  The points are scored with the
+saved models, and the results are added to the X_test and
+historic_and_predictions datasets, fire_ids/ and the SHAP store.
+
+Everything written for a file is named after it and replaced when the file
+is processed again, and a file is recorded in the manifest once all of it is
+written, so an update that failed can simply be run again.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import common
+import data_prep
+import display
+import modeling
+
+folder = common.folder
+
+MANIFEST = '{}/update_manifest.json'.format(folder)
+# Date id 1 of the labelled detections
+FIRST_DATE = data_prep.date_ids['1']
+
+
+def init():
+    files = [os.path.basename(file) for file in common.list_files(common.DAILY_FILES)]
+    common.write_json({'files': files}, MANIFEST)
+    print('Recorded', len(files), 'daily files in', MANIFEST)
+
+
+def get_new_files(manifest):
+    processed = set(manifest['files'])
+    return [file for file in common.list_files(common.DAILY_FILES) if os.path.basename(file) not in processed]
+
+
+def get_part_name(file):
+    # Name of the files written for a daily file
+    return 'update-{}'.format(os.path.splitext(os.path.basename(file))[0])
+
+
+def score(df, name):
+    # Predictions of both models, as modeling.model makes them for the test set
+    df = df.dropna()
+    X_tests = []
+    for thresh, rows in [(1, df.thresh < 2), (2, df.thresh == 2)]:
+        path = '{}/X_test_thresh{}'.format(folder, thresh)
+        if not rows.any():
+            common.remove_files('{}/date_block=*/{}.parquet'.format(path, name))
+            continue
+        df_thresh, predictors = modeling.feature_engineering(df[rows].drop(columns=['thresh']), thresh)
+        X_test = modeling.predict(modeling.load_model(thresh), df_thresh[predictors])
+        common.write_dataset(X_test, path, append=True, name=name)
+
+        X_test['model'] = thresh
+        X_tests.append(X_test)
+
+    return pd.concat(X_tests) if X_tests else None
+
+
+def write_fire_ids(df_pred, name):
+    # Fires found among the predictions of a file are numbered after those
+    # of the full run and of the other files
+    path = '{}/fire_ids/{}.csv'.format(folder, name)
+    df_ids = display.get_id_frame(df_pred)
+    last_id = display.read_fire_ids(exclude=path).wildfire_id.max()
+    df_ids['wildfire_id'] += 0 if np.isnan(last_id) else int(last_id)
+
+    if 'gs://' not in path:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    df_ids.to_csv(path)
+
+
+def update_file(file, labelled):
+    name = get_part_name(file)
+
+    new_date_ids = np.unique(labelled.date_id)
+    print('Preparing dates', [data_prep.date_ids[str(int(date_id))] for date_id in new_date_ids])
+    df_fire = data_prep.read_labelled_counts(new_date_ids.min() - data_prep.LOOK_BACK_DAYS, new_date_ids.max() + 1)
+    df = data_prep.prepare_points(df_fire[df_fire.date_id.isin(new_date_ids)].copy())
+    df = data_prep.prepare_features(df, df_fire, rebuild_weather=False)
+
+    X_test = score(df, name)
+    if X_test is not None:
+        dates = sorted(X_test.date.unique())
+        display.append_shap_store(display.get_shap_dicts(X_test, dates), '{}/shap_store'.format(folder))
+        write_fire_ids(X_test[['latitude', 'longitude', 'date']], name)
+    else:
+        common.remove_files('{}/fire_ids/{}.csv'.format(folder, name))
+        X_test = pd.DataFrame(columns=['latitude', 'longitude', 'date', 'date_id', 'Target', 'Pred'])
+
+    common.write_dataset(display.get_display_frame(labelled, X_test),
+                         '{}/historic_and_predictions'.format(folder), append=True, name=name)
+
+
+def update():
+    manifest = common.read_json(MANIFEST)
+    if manifest is None:
+        raise RuntimeError('{} not found: run the full pipeline, then update.py --init'.format(MANIFEST))
+
+    files = get_new_files(manifest)
+    if not files:
+        print('No new daily files')
+        return
+
+    # All new files are labelled first, so that the targets of each file's
+    # dates read the detections of the following day
+    print('Labelling', len(files), 'new daily files')
+    labelled = {}
+    for file in files:
+        labelled[file] = data_prep.label_detections(common.get_daily_raw([file]), first_date=FIRST_DATE)
+        if len(labelled[file]):
+            common.write_dataset(labelled[file], '{}/labelled_1Mile'.format(folder), append=True,
+                                 name=get_part_name(file))
+
+    for file in files:
+        if len(labelled[file]):
+            update_file(file, labelled[file])
+
+        manifest['files'].append(os.path.basename(file))
+        common.write_json(manifest, MANIFEST)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incremental daily update of the modeling artifacts.')
+    parser.add_argument('--init', action='store_true',
+                        help='record the daily files covered by a full run, without processing them')
+    args = parser.parse_args()
+
+    if args.init:
+        init()
+    else:
+        update()